@@ -1,9 +1,26 @@
 #!/usr/bin/env python3
 
+import argparse
+import array
+import collections
+import concurrent.futures
+import csv
+import hashlib
 import json
+import mmap
+import os
 import pygame
+import struct
 import sys
+import tempfile
+import threading
 import time
+import weakref
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 pygame.mixer.pre_init()
 pygame.init()
@@ -14,14 +31,35 @@ WIDTH = 1280
 HEIGHT = 640
 FPS = 60
 GRID_SIZE = 64
+CHUNK_WIDTH = 8 * GRID_SIZE
+SECTOR_WIDTH = WIDTH
+ATLAS_COLUMNS = 8
+ATLAS_CACHE = "cache/atlas"
+SOUND_CHANNELS = 8
 
 # Options
 sound_on = True
+debug = False
+vectorized_enemies = True
+vectorize_min_awake = 64
+chunk_cache_mb = 32
+compile_levels = True
+profile_frames = 600
+fixed_timestep = True
+max_catch_up = 5
+render_fps = FPS
+throttle_idle = True
+idle_timeout_ms = 250
+watch_interval = 0.5
+stream_ahead = 4 * WIDTH
+stream_behind = 3 * WIDTH
+stream_budget_ms = 2
 
 # Controls
 LEFT = pygame.K_LEFT
 RIGHT = pygame.K_RIGHT
 JUMP = pygame.K_SPACE
+PROFILE_KEY = pygame.K_F3
 
 # Levels
 levels = ["levels/world-1.json",
@@ -29,6 +67,20 @@ levels = ["levels/world-1.json",
           "levels/world-3.json",
           "levels/world-4.json"]
 
+LEVEL_CACHE = "cache/levels"
+STREAM_HEADER = "level.json"
+STREAM_CHUNK = "chunk-{:05d}.json"
+STREAM_BATCH = 16
+REPLAY_MAGIC = b"BRRP"
+REPLAY_VERSION = 1
+REPLAY_CHECKPOINT = FPS
+LEVEL_MAGIC = b"BRUN"
+LEVEL_VERSION = 3
+SNAPSHOT_MAGIC = b"BRSV"
+SNAPSHOT_VERSION = 1
+ENTITY_KINDS = ['bears', 'monsters', 'flyman', 'coins', 'oneups', 'hearts',
+                'powerup', 'bolt', 'jetpack', 'bubble', 'flag']
+
 # Colors
 TRANSPARENT = (0, 0, 0, 0)
 DARK_BLUE = (16, 86, 103)
@@ -39,6 +91,8 @@ PURPLE = (197, 122, 255)
 # Fonts
 Bubblegum_Font = pygame.font.Font("assets/fonts/Bubblegum.ttf", 32)
 Chocolate_Bar_Font = pygame.font.Font("assets/fonts/Chocolate Bar.otf", 72)
+Debug_Font = pygame.font.Font(None, 20)
+TEXT_CACHE_SIZE = 64
 
 # Helper functions
 def load_image(file_path):
@@ -47,81 +101,308 @@ def load_image(file_path):
 
     return img
 
-def play_sound(sound, loops=0, maxtime=0, fade_ms=0):
-    if sound_on:
-        if maxtime == 0:
-            sound.play(loops, maxtime, fade_ms)
-        else:
-            sound.play(loops, maxtime, fade_ms)
+class Atlas():
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.paths = []
+        self.views = []
+        self.sheet = None
+        self.images = {}
+
+    def register(self, container, slots):
+        for slot, path in slots:
+            if path not in self.paths:
+                self.paths.append(path)
+
+        self.views.append((container, slots))
+
+        return container
+
+    def group(self, mapping):
+        slots = [(k, v) for k, v in mapping.items() if isinstance(v, str)]
+        return self.register(dict(mapping), slots)
+
+    def frames(self, paths):
+        return self.register(list(paths), list(enumerate(paths)))
+
+    def cell(self, i):
+        columns = ATLAS_COLUMNS
+        return pygame.Rect((i % columns) * GRID_SIZE, (i // columns) * GRID_SIZE, GRID_SIZE, GRID_SIZE)
+
+    def manifest(self):
+        sources = []
+
+        for path in self.paths:
+            with open(path, 'rb') as f:
+                sources.append([path, hashlib.sha1(f.read()).hexdigest()])
+
+        return {"grid-size": GRID_SIZE, "columns": ATLAS_COLUMNS, "sources": sources}
+
+    def build(self):
+        manifest = self.manifest()
+        manifest_path = self.cache_path + ".json"
+        sheet_path = self.cache_path + ".png"
+
+        try:
+            with open(manifest_path, 'r') as f:
+                cached = json.loads(f.read())
+
+            if cached == manifest:
+                self.sheet = pygame.image.load(sheet_path)
+        except (OSError, ValueError, pygame.error):
+            self.sheet = None
 
-def play_music():
-    if sound_on:
-        pygame.mixer.music.play(-1)
+        if self.sheet is None:
+            rows = (len(self.paths) + ATLAS_COLUMNS - 1) // ATLAS_COLUMNS
+            self.sheet = pygame.Surface([ATLAS_COLUMNS * GRID_SIZE, rows * GRID_SIZE], pygame.SRCALPHA, 32)
+
+            for i, path in enumerate(self.paths):
+                self.sheet.blit(load_image(path), self.cell(i))
+
+            try:
+                os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+                pygame.image.save(self.sheet, sheet_path)
+
+                with open(manifest_path, 'w') as f:
+                    f.write(json.dumps(manifest))
+            except (OSError, pygame.error):
+                pass
+
+        self.refresh()
+
+    def convert(self):
+        # Needs a display mode, so this runs once the window exists
+        self.sheet = self.sheet.convert_alpha()
+        self.refresh()
+
+    def refresh(self):
+        self.images = {path: self.sheet.subsurface(self.cell(i)) for i, path in enumerate(self.paths)}
+
+        for container, slots in self.views:
+            for slot, path in slots:
+                container[slot] = self.images[path]
 
 # Images
-bunny_walk1 = load_image("assets/Players/bunny2_walk1.png")
-bunny_walk2 = load_image("assets/Players/bunny2_walk2.png")
-bunny_jump = load_image("assets/Players/bunny2_jump.png")
-bunny_idle = load_image("assets/Players/bunny2_stand.png")
-bunny_images = {"run": [bunny_walk1, bunny_walk2],
-               "jump": bunny_jump,
-               "idle": bunny_idle}
-
-block_images = {"G": load_image("assets/Environment/ground_grass.png"),
-                "GB": load_image("assets/Environment/ground_grass_broken.png"),
-                "GS": load_image("assets/Environment/ground_grass_small.png"),
-                "GSB": load_image("assets/Environment/ground_grass_small_broken.png"),
-                "C": load_image("assets/Environment/ground_cake.png"),
-                "CB": load_image("assets/Environment/ground_cake_broken.png"),
-                "CS": load_image("assets/Environment/ground_cake_small.png"),
-                "CSB": load_image("assets/Environment/ground_cake_small_broken.png"),
-                "S": load_image("assets/Environment/ground_sand.png"),
-                "SB": load_image("assets/Environment/ground_sand_broken.png"),
-                "SS": load_image("assets/Environment/ground_sand_small.png"),
-                "SSB": load_image("assets/Environment/ground_sand_small_broken.png"),
-                "SN": load_image("assets/Environment/ground_snow.png"),
-                "SNB": load_image("assets/Environment/ground_snow_broken.png"),
-                "SNS": load_image("assets/Environment/ground_snow_small.png"),
-                "SNSB": load_image("assets/Environment/ground_snow_small_broken.png"),
-                "ST": load_image("assets/Environment/ground_stone.png"),
-                "STB": load_image("assets/Environment/ground_stone_broken.png"),
-                "STS": load_image("assets/Environment/ground_stone_small.png"),
-                "STSB": load_image("assets/Environment/ground_stone_small_broken.png"),
-                "W": load_image("assets/Environment/ground_wood.png"),
-                "WB": load_image("assets/Environment/ground_wood_broken.png"),
-                "WS": load_image("assets/Environment/ground_wood_small.png"),
-                "WSB": load_image("assets/Environment/ground_wood_small_broken.png")}
-
-coin_img = load_image("assets/Items/gold_1.png")
-powerup_img = load_image("assets/Items/powerup_bunny.png")
-carrot_img = load_image("assets/Items/carrot.png")
-portal_img = load_image("assets/Items/portal_yellow.png")
-gold_carrot_img = load_image("assets/Items/carrot_gold.png")
-bubble_img = load_image("assets/Items/bubble.png")
-bolt_img = load_image("assets/Particles/lighting_blue.png")
-jetpack_img = load_image("assets/Items/jetpack.png")
-
-spikeball_img1 = load_image("assets/Enemies/spikeBall1.png")
-spikeball_img2 = load_image("assets/Enemies/spikeBall2.png")
-spikeball_images = [spikeball_img1, spikeball_img2]
-
-spikeman_img = load_image("assets/Enemies/spikeMan_stand.png")
-spikeman_walk1 = load_image("assets/Enemies/spikeMan_walk1.png")
-spikeman_walk2 = load_image("assets/Enemies/spikeMan_walk2.png")
-spikeman_images = [spikeman_walk1, spikeman_walk2]
-
-flyman_img1 = load_image("assets/Enemies/flyMan_stand.png")
-flyman_img2 = load_image("assets/Enemies/flyMan_fly.png")
-flyman_images = [flyman_img1, flyman_img2]
+atlas = Atlas(ATLAS_CACHE)
+
+bunny_images = atlas.group({"run": atlas.frames(["assets/Players/bunny2_walk1.png",
+                                                 "assets/Players/bunny2_walk2.png"]),
+                            "jump": "assets/Players/bunny2_jump.png",
+                            "idle": "assets/Players/bunny2_stand.png"})
+
+block_images = atlas.group({"G": "assets/Environment/ground_grass.png",
+                            "GB": "assets/Environment/ground_grass_broken.png",
+                            "GS": "assets/Environment/ground_grass_small.png",
+                            "GSB": "assets/Environment/ground_grass_small_broken.png",
+                            "C": "assets/Environment/ground_cake.png",
+                            "CB": "assets/Environment/ground_cake_broken.png",
+                            "CS": "assets/Environment/ground_cake_small.png",
+                            "CSB": "assets/Environment/ground_cake_small_broken.png",
+                            "S": "assets/Environment/ground_sand.png",
+                            "SB": "assets/Environment/ground_sand_broken.png",
+                            "SS": "assets/Environment/ground_sand_small.png",
+                            "SSB": "assets/Environment/ground_sand_small_broken.png",
+                            "SN": "assets/Environment/ground_snow.png",
+                            "SNB": "assets/Environment/ground_snow_broken.png",
+                            "SNS": "assets/Environment/ground_snow_small.png",
+                            "SNSB": "assets/Environment/ground_snow_small_broken.png",
+                            "ST": "assets/Environment/ground_stone.png",
+                            "STB": "assets/Environment/ground_stone_broken.png",
+                            "STS": "assets/Environment/ground_stone_small.png",
+                            "STSB": "assets/Environment/ground_stone_small_broken.png",
+                            "W": "assets/Environment/ground_wood.png",
+                            "WB": "assets/Environment/ground_wood_broken.png",
+                            "WS": "assets/Environment/ground_wood_small.png",
+                            "WSB": "assets/Environment/ground_wood_small_broken.png"})
+
+item_images = atlas.group({"coin": "assets/Items/gold_1.png",
+                           "powerup": "assets/Items/powerup_bunny.png",
+                           "carrot": "assets/Items/carrot.png",
+                           "portal": "assets/Items/portal_yellow.png",
+                           "gold_carrot": "assets/Items/carrot_gold.png",
+                           "bubble": "assets/Items/bubble.png",
+                           "bolt": "assets/Particles/lighting_blue.png",
+                           "jetpack": "assets/Items/jetpack.png"})
+
+spikeball_images = atlas.frames(["assets/Enemies/spikeBall1.png",
+                                 "assets/Enemies/spikeBall2.png"])
+
+spikeman_images = atlas.frames(["assets/Enemies/spikeMan_walk1.png",
+                                "assets/Enemies/spikeMan_walk2.png"])
+
+flyman_images = atlas.frames(["assets/Enemies/flyMan_stand.png",
+                              "assets/Enemies/flyMan_fly.png"])
+
+atlas.build()
+
+class FrameCache():
+
+    # Transformed copies of the atlas images, made once and shared by every entity.
+    # Animation sets are looked up by the list the atlas hands out and come back as
+    # shared lists, which refresh() redraws in place after the atlas is converted.
+    TRANSFORMS = {"flip-x": lambda img: pygame.transform.flip(img, 1, 0)}
+
+    def __init__(self):
+        self.sets = {}
+        self.images = {}
+
+    def get(self, images, transform):
+        if isinstance(images, pygame.Surface):
+            key = (images, transform)
+
+            if key not in self.images:
+                self.images[key] = self.TRANSFORMS[transform](images)
+
+            return self.images[key]
+
+        key = (id(images), transform)
+
+        if key not in self.sets:
+            # Holding the source keeps its id from being reused
+            self.sets[key] = (images, [self.TRANSFORMS[transform](img) for img in images])
+
+        return self.sets[key][1]
+
+    def refresh(self):
+        for (source_id, transform), (source, frames) in self.sets.items():
+            frames[:] = [self.TRANSFORMS[transform](img) for img in source]
+
+        self.images = {}
+
+frame_cache = FrameCache()
+
+class AudioManager():
+
+    # Effects play on a fixed pool of reserved channels. Each sound has a limit on how many
+    # copies can play at once and a cooldown between starts. Sounds are decoded the first
+    # time they play. Every music call runs in order on one worker thread, so a slow load
+    # never holds up the game and a play or stop can't land in the middle of it.
+    def __init__(self, channels):
+        self.size = channels
+        self.channels = None
+        self.started = [0] * channels
+        self.rules = {}
+        self.sounds = {}
+        self.last_played = {}
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        self.wanted = None
+        self.loaded = None
+        self.play_requested = None
+
+    def register(self, path, limit=1, cooldown=0):
+        self.rules[path] = (limit, cooldown)
+        return path
+
+    def sound(self, path):
+        sound = self.sounds.get(path)
+
+        if sound is None:
+            sound = pygame.mixer.Sound(path)
+            self.sounds[path] = sound
+
+        return sound
+
+    def pick_channel(self, sound, limit):
+        # Restart the oldest copy of this sound when it's at its limit, otherwise take
+        # a free channel, otherwise cut off whatever started longest ago
+        if self.channels is None:
+            pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), self.size))
+            pygame.mixer.set_reserved(self.size)
+            self.channels = [pygame.mixer.Channel(i) for i in range(self.size)]
+
+        busy = [i for i, c in enumerate(self.channels) if c.get_busy()]
+        copies = [i for i in busy if self.channels[i].get_sound() is sound]
+
+        if len(copies) >= limit:
+            return min(copies, key=self.started.__getitem__)
+
+        for i in range(self.size):
+            if i not in busy:
+                return i
+
+        return min(busy, key=self.started.__getitem__)
+
+    def play(self, path):
+        if not sound_on or pygame.mixer.get_init() is None:
+            return
+
+        limit, cooldown = self.rules[path]
+        now = pygame.time.get_ticks()
+        last = self.last_played.get(path)
+
+        if last is not None and now - last < cooldown:
+            return
+
+        sound = self.sound(path)
+        i = self.pick_channel(sound, limit)
+        self.channels[i].play(sound)
+        self.started[i] = now
+        self.last_played[path] = now
+
+    def load_music(self, path):
+        with self.lock:
+            self.wanted = path
+            self.loaded = None
+            self.play_requested = None
+
+        self.executor.submit(self.load_music_now, path)
+
+    def load_music_now(self, path):
+        # The lock only covers the bookkeeping, never the load itself
+        with self.lock:
+            if path != self.wanted:
+                return
+
+        try:
+            pygame.mixer.music.load(path)
+        except pygame.error as e:
+            if debug:
+                print("Couldn't load music {}: {}".format(path, e))
+            return
+
+        with self.lock:
+            if path == self.wanted:
+                self.loaded = path
+
+    def play_music_now(self):
+        with self.lock:
+            play = self.play_requested is not None and self.play_requested == self.loaded
+
+        if play:
+            pygame.mixer.music.play(-1)
+
+    def stop_music_now(self):
+        pygame.mixer.music.stop()
+
+    def play_music(self):
+        if not sound_on:
+            return
+
+        # Queued behind any load still running, so it starts as soon as the music is ready
+        with self.lock:
+            self.play_requested = self.wanted
+
+        self.executor.submit(self.play_music_now)
+
+    def stop_music(self):
+        with self.lock:
+            self.play_requested = None
+
+        self.executor.submit(self.stop_music_now)
 
 # Sounds
-JUMP_SOUND = pygame.mixer.Sound("assets/sounds/jump.wav")
-COIN_SOUND = pygame.mixer.Sound("assets/sounds/pickup_coin.wav")
-POWERUP_SOUND = pygame.mixer.Sound("assets/sounds/powerup.wav")
-HURT_SOUND = pygame.mixer.Sound("assets/sounds/hurt.ogg")
-DIE_SOUND = pygame.mixer.Sound("assets/sounds/death.wav")
-LEVELUP_SOUND = pygame.mixer.Sound("assets/sounds/level_up.wav")
-GAMEOVER_SOUND = pygame.mixer.Sound("assets/sounds/game_over.wav")
+audio = AudioManager(SOUND_CHANNELS)
+
+JUMP_SOUND = audio.register("assets/sounds/jump.wav", limit=1)
+COIN_SOUND = audio.register("assets/sounds/pickup_coin.wav", limit=2, cooldown=40)
+POWERUP_SOUND = audio.register("assets/sounds/powerup.wav", limit=2, cooldown=40)
+HURT_SOUND = audio.register("assets/sounds/hurt.ogg", limit=1, cooldown=250)
+DIE_SOUND = audio.register("assets/sounds/death.wav")
+LEVELUP_SOUND = audio.register("assets/sounds/level_up.wav")
+GAMEOVER_SOUND = audio.register("assets/sounds/game_over.wav")
 
 class Entity(pygame.sprite.Sprite):
 
@@ -140,21 +421,21 @@ class Entity(pygame.sprite.Sprite):
         self.vy += level.gravity
         self.vy = min(self.vy, level.terminal_velocity)
 
-class Block(Entity):
-
-    def __init__(self, x, y, image):
-        super().__init__(x, y, image)
-
 class Character(Entity):
 
-    def __init__(self, images):
+    STATE = ["speed", "vx", "vy", "facing_right", "on_ground", "jetpack_on", "score", "lives", "hearts",
+             "max_hearts", "invincibility", "jetpack_time", "coins", "image_index", "steps"]
+
+    def __init__(self, images, muted=False):
         super().__init__(0, 0, images['idle'])
 
+        self.muted = muted
+
         self.image_idle = images['idle']
         self.images_run_right = images['run']
-        self.images_run_left = [pygame.transform.flip(img, 1, 0) for img in self.images_run_right]
+        self.images_run_left = frame_cache.get(self.images_run_right, "flip-x")
         self.image_jump_right = images['jump']
-        self.image_jump_left = pygame.transform.flip(self.image_jump_right, 1, 0)
+        self.image_jump_left = frame_cache.get(self.image_jump_right, "flip-x")
 
         self.running_images = self.images_run_right
         self.image_index = 0
@@ -177,6 +458,29 @@ class Character(Entity):
         self.jetpack_time = 0
         self.coins = 0
 
+    def play(self, sound):
+        if not self.muted:
+            audio.play(sound)
+
+    def images(self):
+        return [self.image_idle, self.image_jump_right, self.image_jump_left] + self.images_run_right + self.images_run_left
+
+    def state(self):
+        state = {name: getattr(self, name) for name in self.STATE}
+        state["x"], state["y"] = self.rect.topleft
+        state["running_right"] = self.running_images is self.images_run_right
+        state["image"] = self.images().index(self.image)
+
+        return state
+
+    def set_state(self, state):
+        for name in self.STATE:
+            setattr(self, name, state[name])
+
+        self.rect.topleft = (state["x"], state["y"])
+        self.running_images = self.images_run_right if state["running_right"] else self.images_run_left
+        self.image = self.images()[state["image"]]
+
     def move_left(self):
         self.vx = -self.speed
         self.facing_right = False
@@ -188,14 +492,14 @@ class Character(Entity):
     def stop(self):
         self.vx = 0
 
-    def jump(self, blocks):
+    def jump(self, tiles):
         self.rect.y += 1
 
-        hit_list = pygame.sprite.spritecollide(self, blocks, False)
+        hit_list = tiles.collide(self.rect)
 
         if len(hit_list) > 0:
             self.vy = -1 * self.jump_power
-            play_sound(JUMP_SOUND)
+            self.play(JUMP_SOUND)
 
         self.rect.y -= 1
 
@@ -205,36 +509,36 @@ class Character(Entity):
         elif self.rect.right > level.width:
             self.rect.right = level.width
 
-    def move_and_process_blocks(self, blocks):
+    def move_and_process_blocks(self, tiles):
         self.rect.x += self.vx
-        hit_list = pygame.sprite.spritecollide(self, blocks, False)
+        hit_list = tiles.collide(self.rect)
 
         for block in hit_list:
             if self.vx > 0:
-                self.rect.right = block.rect.left
+                self.rect.right = block.left
                 self.vx = 0
             elif self.vx < 0:
-                self.rect.left = block.rect.right
+                self.rect.left = block.right
                 self.vx = 0
 
         self.on_ground = False
         self.rect.y += self.vy
-        hit_list = pygame.sprite.spritecollide(self, blocks, False)
+        hit_list = tiles.collide(self.rect)
 
         for block in hit_list:
             if self.vy > 0:
-                self.rect.bottom = block.rect.top
+                self.rect.bottom = block.top
                 self.vy = 0
                 self.on_ground = True
             elif self.vy < 0:
-                self.rect.top = block.rect.bottom
+                self.rect.top = block.bottom
                 self.vy = 0
 
     def process_coins(self, coins):
-        hit_list = pygame.sprite.spritecollide(self, coins, True)
+        hit_list = coins.collide(self, True)
 
         for coin in hit_list:
-            play_sound(COIN_SOUND)
+            self.play(COIN_SOUND)
             self.score += coin.value
             self.coins += 1
             if self.coins == 10:
@@ -242,26 +546,26 @@ class Character(Entity):
                 self.coins = 0
 
     def process_enemies(self, enemies):
-        hit_list = pygame.sprite.spritecollide(self, enemies, False)
+        hit_list = enemies.collide(self, False)
 
         if len(hit_list) > 0 and self.invincibility == 0:
-            play_sound(HURT_SOUND)
+            self.play(HURT_SOUND)
             self.hearts -= 1
             self.invincibility = int(0.75 * FPS)
 
     def process_powerups(self, powerups):
-        hit_list = pygame.sprite.spritecollide(self, powerups, True)
+        hit_list = powerups.collide(self, True)
 
         for p in hit_list:
-            play_sound(POWERUP_SOUND)
+            self.play(POWERUP_SOUND)
             p.apply(self)
 
     def check_flag(self, level):
-        hit_list = pygame.sprite.spritecollide(self, level.flag, False)
+        hit_list = level.flag_hash.collide(self, False)
 
         if len(hit_list) > 0:
             level.completed = True
-            play_sound(LEVELUP_SOUND)
+            self.play(LEVELUP_SOUND)
 
     def set_image(self):
         if self.on_ground:
@@ -288,9 +592,9 @@ class Character(Entity):
         self.lives -= 1
 
         if self.lives > 0:
-            play_sound(DIE_SOUND)
+            self.play(DIE_SOUND)
         else:
-            play_sound(GAMEOVER_SOUND)
+            self.play(GAMEOVER_SOUND)
 
     def respawn(self, level):
         self.rect.x = level.start_x
@@ -305,18 +609,18 @@ class Character(Entity):
             self.jetpack_time -= 1
 
     def update(self, level):
-        self.process_enemies(level.enemies)
+        self.process_enemies(level.enemy_hash)
         if self.jetpack_on == True:
             pass
         else:
             self.apply_gravity(level)
-        self.move_and_process_blocks(level.blocks)
+        self.move_and_process_blocks(level.tiles)
         self.check_world_boundaries(level)
         self.set_image()
 
         if self.hearts > 0:
-            self.process_coins(level.coins)
-            self.process_powerups(level.powerups)
+            self.process_coins(level.coin_hash)
+            self.process_powerups(level.powerup_hash)
             self.check_flag(level)
 
             if self.invincibility > 0:
@@ -331,11 +635,16 @@ class Coin(Entity):
         self.value = 10
 
 class Enemy(Entity):
+
+    # Field names and array typecodes, in the order state() returns them
+    STATE = [("x", 'q'), ("y", 'q'), ("vx", 'q'), ("vy", 'd'), ("steps", 'q'), ("image_index", 'q'),
+             ("facing_right", 'b'), ("shown_right", 'b'), ("shown_index", 'q')]
+
     def __init__(self, x, y, images):
         super().__init__(x, y, images[0])
 
         self.images_right = images
-        self.images_left = [pygame.transform.flip(img, 1, 0) for img in images]
+        self.images_left = frame_cache.get(images, "flip-x")
         self.current_images = self.images_left
         self.image_index = 0
         self.steps = 0
@@ -350,6 +659,24 @@ class Enemy(Entity):
 
         self.image = self.current_images[self.image_index]
 
+    def state(self):
+        shown_right = self.image in self.images_right
+        shown = self.images_right if shown_right else self.images_left
+
+        return (self.rect.x, self.rect.y, self.vx, self.vy, self.steps, self.image_index,
+                self.current_images is self.images_right, shown_right, shown.index(self.image))
+
+    def set_state(self, x, y, vx, vy, steps, image_index, facing_right, shown_right, shown_index):
+        self.rect.x = x
+        self.rect.y = y
+        self.vx = vx
+        self.vy = vy
+        self.steps = steps
+        self.image_index = image_index
+        self.current_images = self.images_right if facing_right else self.images_left
+        shown = self.images_right if shown_right else self.images_left
+        self.image = shown[shown_index]
+
     def check_world_boundaries(self, level):
         if self.rect.left < 0:
             self.rect.left = 0
@@ -392,35 +719,36 @@ class Bear(Enemy):
         self.vx = self.start_vx
         self.vy = self.start_vy
 
-    def move_and_process_blocks(self, blocks):
+    def move_and_process_blocks(self, tiles):
         self.rect.x += self.vx
-        hit_list = pygame.sprite.spritecollide(self, blocks, False)
+        hit_list = tiles.collide(self.rect)
 
         for block in hit_list:
             if self.vx > 0:
-                self.rect.right = block.rect.left
+                self.rect.right = block.left
                 self.reverse()
             elif self.vx < 0:
-                self.rect.left = block.rect.right
+                self.rect.left = block.right
                 self.reverse()
 
         self.rect.y += self.vy
-        hit_list = pygame.sprite.spritecollide(self, blocks, False)
+        hit_list = tiles.collide(self.rect)
 
         for block in hit_list:
             if self.vy > 0:
-                self.rect.bottom = block.rect.top
+                self.rect.bottom = block.top
                 self.vy = 0
             elif self.vy < 0:
-                self.rect.top = block.rect.bottom
+                self.rect.top = block.bottom
                 self.vy = 0
 
     def update(self, level, hero):
         if self.is_near(hero):
             self.apply_gravity(level)
-            self.move_and_process_blocks(level.blocks)
+            self.move_and_process_blocks(level.tiles)
             self.check_world_boundaries(level)
             self.set_images()
+            level.enemy_hash.move(self)
 
 class Monster(Enemy):
     def __init__(self, x, y, images):
@@ -434,38 +762,38 @@ class Monster(Enemy):
         self.vx = self.start_vx
         self.vy = self.start_vy
 
-    def move_and_process_blocks(self, blocks):
+    def move_and_process_blocks(self, tiles):
         reverse = False
 
         self.rect.x += self.vx
-        hit_list = pygame.sprite.spritecollide(self, blocks, False)
+        hit_list = tiles.collide(self.rect)
 
         for block in hit_list:
             if self.vx > 0:
-                self.rect.right = block.rect.left
+                self.rect.right = block.left
                 self.reverse()
             elif self.vx < 0:
-                self.rect.left = block.rect.right
+                self.rect.left = block.right
                 self.reverse()
 
         self.rect.y += self.vy
-        hit_list = pygame.sprite.spritecollide(self, blocks, False)
+        hit_list = tiles.collide(self.rect)
 
         reverse = True
 
         for block in hit_list:
             if self.vy >= 0:
-                self.rect.bottom = block.rect.top
+                self.rect.bottom = block.top
                 self.vy = 0
 
-                if self.vx > 0 and self.rect.right <= block.rect.right:
+                if self.vx > 0 and self.rect.right <= block.right:
                     reverse = False
 
-                elif self.vx < 0 and self.rect.left >= block.rect.left:
+                elif self.vx < 0 and self.rect.left >= block.left:
                     reverse = False
 
             elif self.vy < 0:
-                self.rect.top = block.rect.bottom
+                self.rect.top = block.bottom
                 self.vy = 0
 
         if reverse:
@@ -474,9 +802,10 @@ class Monster(Enemy):
     def update(self, level, hero):
         if self.is_near(hero):
             self.apply_gravity(level)
-            self.move_and_process_blocks(level.blocks)
+            self.move_and_process_blocks(level.tiles)
             self.check_world_boundaries(level)
             self.set_images()
+            level.enemy_hash.move(self)
 
 class FlyMan(Enemy):
     
@@ -491,34 +820,35 @@ class FlyMan(Enemy):
         self.vx = self.start_vx
         self.vy = self.start_vy
 
-    def move_and_process_blocks(self, blocks):
+    def move_and_process_blocks(self, tiles):
         self.rect.x += self.vx
-        hit_list = pygame.sprite.spritecollide(self, blocks, False)
+        hit_list = tiles.collide(self.rect)
 
         for block in hit_list:
             if self.vx > 0:
-                self.rect.right = block.rect.left
+                self.rect.right = block.left
                 self.reverse()
             elif self.vx < 0:
-                self.rect.left = block.rect.right
+                self.rect.left = block.right
                 self.reverse()
 
         self.rect.y += self.vy
-        hit_list = pygame.sprite.spritecollide(self, blocks, False)
+        hit_list = tiles.collide(self.rect)
 
         for block in hit_list:
             if self.vy > 0:
-                self.rect.bottom = block.rect.top
+                self.rect.bottom = block.top
                 self.vy = 0
             elif self.vy < 0:
-                self.rect.top = block.rect.bottom
+                self.rect.top = block.bottom
                 self.vy = 0
 
     def update(self, level, hero):
         if self.is_near(hero):
-            self.move_and_process_blocks(level.blocks)
+            self.move_and_process_blocks(level.tiles)
             self.check_world_boundaries(level)
             self.set_images()
+            level.enemy_hash.move(self)
 
 class OneUp(Entity):
     def __init__(self, x, y, image):
@@ -560,7 +890,7 @@ class Jetpack(Entity):
         character.jetpack_time = 3 * FPS
         character.vy = 0
         character.vx = 15
-        game.hero.rect.y = 64
+        character.rect.y = 64
        
 class Bubble(Entity):
     def __init__(self, x, y, image):
@@ -573,412 +903,2601 @@ class Flag(Entity):
     def __init__(self, x, y, image):
         super().__init__(x, y, image)
 
-class Level():
+def merge_cells(columns, first, last, rows, start):
+    # Greedily covers the solid cells of columns first to last - 1 with rectangles: take
+    # the first free cell in reading order, grow it right along the row, then down while
+    # the whole span is solid. Returns the rectangles and each column's owner array,
+    # which maps a cell to its rectangle's number; numbers follow on from start.
+    owners = {col: array.array('i', bytes(4 * rows)) for col in range(first, last)}
+    colliders = []
 
-    def __init__(self, file_path):
-        self.starting_blocks = []
-        self.starting_enemies = []
-        self.starting_coins = []
-        self.starting_powerups = []
-        self.starting_flag = []
+    for row in range(rows):
+        col = first
 
-        self.blocks = pygame.sprite.Group()
-        self.enemies = pygame.sprite.Group()
-        self.coins = pygame.sprite.Group()
-        self.powerups = pygame.sprite.Group()
-        self.flag = pygame.sprite.Group()
-        self.active_sprites = pygame.sprite.Group()
-        self.inactive_sprites = pygame.sprite.Group()
+        while col < last:
+            if not columns[col][row] or owners[col][row]:
+                col += 1
+                continue
 
-        with open(file_path, 'r') as f:
-            data = f.read()
+            end = col + 1
 
-        map_data = json.loads(data)
+            while end < last and columns[end][row] and not owners[end][row]:
+                end += 1
 
-        self.width = map_data['width'] * GRID_SIZE
-        self.height = map_data['height'] * GRID_SIZE
-        self.time = map_data['time'] * FPS
+            bottom = row + 1
 
-        self.start_x = map_data['start'][0] * GRID_SIZE
-        self.start_y = map_data['start'][1] * GRID_SIZE
+            while bottom < rows and all(columns[c][bottom] and not owners[c][bottom] for c in range(col, end)):
+                bottom += 1
 
-        for item in map_data['blocks']:
-            x, y = item[0] * GRID_SIZE, item[1] * GRID_SIZE
-            img = block_images[item[2]]
-            self.starting_blocks.append(Block(x, y, img))
-
-        for item in map_data['bears']:
-            x, y = item[0] * GRID_SIZE, item[1] * GRID_SIZE
-            self.starting_enemies.append(Bear(x, y, spikeman_images))
-
-        for item in map_data['monsters']:
-            x, y = item[0] * GRID_SIZE, item[1] * GRID_SIZE
-            self.starting_enemies.append(Monster(x, y, spikeball_images))
-
-        for item in map_data['flyman']:
-            x, y = item[0] * GRID_SIZE, item[1] * GRID_SIZE
-            self.starting_enemies.append(FlyMan(x, y, flyman_images))
-
-        for item in map_data['coins']:
-            x, y = item[0] * GRID_SIZE, item[1] * GRID_SIZE
-            self.starting_coins.append(Coin(x, y, coin_img))
-
-        for item in map_data['oneups']:
-            x, y = item[0] * GRID_SIZE, item[1] * GRID_SIZE
-            self.starting_powerups.append(OneUp(x, y, carrot_img))
-
-        for item in map_data['hearts']:
-            x, y = item[0] * GRID_SIZE, item[1] * GRID_SIZE
-            self.starting_powerups.append(Heart(x, y, powerup_img))
-
-        for item in map_data['powerup']:
-            x, y = item[0] * GRID_SIZE, item[1] * GRID_SIZE
-            self.starting_powerups.append(Powerup(x, y, gold_carrot_img))
-
-        for item in map_data['bolt']:
-            x, y = item[0] * GRID_SIZE, item[1] * GRID_SIZE
-            self.starting_powerups.append(Bolt(x, y, bolt_img))
-
-        for item in map_data['jetpack']:
-            x, y = item[0] * GRID_SIZE, item[1] * GRID_SIZE
-            self.starting_powerups.append(Jetpack(x, y, jetpack_img))
-
-        for item in map_data['bubble']:
-            x, y = item[0] * GRID_SIZE, item[1] * GRID_SIZE
-            self.starting_powerups.append(Bubble(x, y, bubble_img))
-
-        for item in map_data['flag']:
-            x, y = item[0] * GRID_SIZE, item[1] * GRID_SIZE
-            self.starting_flag.append(Flag(x, y, portal_img))
-
-        self.background_layer = pygame.Surface([self.width, self.height], pygame.SRCALPHA, 32)
-        self.scenery_layer = pygame.Surface([self.width, self.height], pygame.SRCALPHA, 32)
-        self.inactive_layer = pygame.Surface([self.width, self.height], pygame.SRCALPHA, 32)
-        self.active_layer = pygame.Surface([self.width, self.height], pygame.SRCALPHA, 32)
-
-        if map_data['background-color'] != "":
-            self.background_layer.fill(map_data['background-color'])
-
-        if map_data['background-img'] != "":
-            background_img = pygame.image.load(map_data['background-img'])
-
-            if map_data['background-fill-y']:
-                h = background_img.get_height()
-                w = int(background_img.get_width() * HEIGHT / h)
-                background_img = pygame.transform.scale(background_img, (w, HEIGHT))
-
-            if "top" in map_data['background-position']:
-                start_y = 0
-            elif "bottom" in map_data['background-position']:
-                start_y = self.height - background_img.get_height()
-
-            if map_data['background-repeat-x']:
-                for x in range(0, self.width, background_img.get_width()):
-                    self.background_layer.blit(background_img, [x, start_y])
-            else:
-                self.background_layer.blit(background_img, [0, start_y])
+            colliders.append(pygame.Rect(col * GRID_SIZE, row * GRID_SIZE,
+                                         (end - col) * GRID_SIZE, (bottom - row) * GRID_SIZE))
+            n = start + len(colliders)
 
-        if map_data['scenery-img'] != "":
-            scenery_img = pygame.image.load(map_data['scenery-img'])
+            for c in range(col, end):
+                owners[c][row:bottom] = array.array('i', [n] * (bottom - row))
 
-            if map_data['scenery-fill-y']:
-                h = scenery_img.get_height()
-                w = int(scenery_img.get_width() * HEIGHT / h)
-                scenery_img = pygame.transform.scale(scenery_img, (w, HEIGHT))
+            col = end
 
-            if "top" in map_data['scenery-position']:
-                start_y = 0
-            elif "bottom" in map_data['scenery-position']:
-                start_y = self.height - scenery_img.get_height()
+    return colliders, owners
 
-            if map_data['scenery-repeat-x']:
-                for x in range(0, self.width, scenery_img.get_width()):
-                    self.scenery_layer.blit(scenery_img, [x, start_y])
-            else:
-                self.scenery_layer.blit(scenery_img, [0, start_y])
+class TileMap():
 
-        pygame.mixer.music.load(map_data['music'])
+    def __init__(self, blocks, width, height):
+        self.names = [None]
+        self.cols = max([width] + [item[0] + 1 for item in blocks])
+        self.rows = max([height] + [item[1] + 1 for item in blocks])
+        self.columns = [bytearray(self.rows) for i in range(self.cols)]
 
-        self.gravity = map_data['gravity']
-        self.terminal_velocity = map_data['terminal-velocity']
+        for item in blocks:
+            self.set(item[0], item[1], item[2])
 
-        self.completed = False
+        self.merge()
 
-        self.blocks.add(self.starting_blocks)
-        self.enemies.add(self.starting_enemies)
-        self.coins.add(self.starting_coins)
-        self.powerups.add(self.starting_powerups)
-        self.flag.add(self.starting_flag)
+    def load(self, names, cols, rows, data, colliders=None, owners=None):
+        self.names = names
+        self.cols = cols
+        self.rows = rows
+        self.columns = [bytearray(data[col * rows:(col + 1) * rows]) for col in range(cols)]
 
-        self.active_sprites.add(self.coins, self.enemies, self.powerups)
-        self.inactive_sprites.add(self.blocks, self.flag)
+        if colliders is None:
+            self.merge()
+        else:
+            table = colliders.tolist()
+            self.colliders = [pygame.Rect(table[i:i + 4]) for i in range(0, len(table), 4)]
+            self.owners = [owners[col * rows:(col + 1) * rows] for col in range(cols)]
 
-        self.inactive_sprites.draw(self.inactive_layer)
+    def set(self, col, row, name):
+        if col < 0 or row < 0:
+            return
 
-    def calculate_time(self):
-        self.time -= 1
-        if self.time <= 0:
-            self.time = 0
+        if name not in self.names:
+            self.names.append(name)
 
-    def reset(self):
-        self.enemies.add(self.starting_enemies)
-        self.coins.add(self.starting_coins)
-        self.powerups.add(self.starting_powerups)
+        self.columns[col][row] = self.names.index(name)
+        self.colliders = None
 
-        self.active_sprites.add(self.coins, self.enemies, self.powerups)
+    def merge(self):
+        colliders, owners = merge_cells(self.columns, 0, self.cols, self.rows, 0)
+        self.colliders = colliders
+        self.owners = [owners[col] for col in range(self.cols)]
 
-        for e in self.enemies:
-            e.reset()
+    def report(self):
+        if self.colliders is None:
+            self.merge()
 
-class Game():
+        cells = sum(self.rows - column.count(0) for column in self.columns)
 
-    SPLASH = 0
-    START = 1
-    PLAYING = 2
-    PAUSED = 3
-    LEVEL_COMPLETED = 4
-    GAME_OVER = 5
-    VICTORY = 6
+        return "Colliders: {} cells merged into {} rectangles ({:.1f}x fewer)".format(
+            cells, len(self.colliders), cells / max(len(self.colliders), 1))
 
-    def __init__(self):
-        self.window = pygame.display.set_mode([WIDTH, HEIGHT])
-        pygame.display.set_caption(TITLE)
-        self.clock = pygame.time.Clock()
-        self.done = False
+    def get(self, col, row):
+        if 0 <= col < self.cols and 0 <= row < self.rows:
+            return self.names[self.columns[col][row]]
 
-        self.reset()
+        return None
 
-    def start(self):
-        self.level = Level(levels[self.current_level])
-        self.level.reset()
-        self.hero.respawn(self.level)
+    def collide(self, rect):
+        # Only looks at the cells under rect, so cost doesn't grow with level size.
+        # Returns each merged rectangle once, in the order its cells are first reached,
+        # cut down to the cells under rect. Something stuck inside a wide rectangle is
+        # then pushed out past the nearest cell, as it was with one sprite per block,
+        # not to the rectangle's far edge.
+        if self.colliders is None:
+            self.merge()
 
-    def advance(self):
-        self.current_level += 1
-        self.start()
-        self.stage = Game.START
-        self.hero.score += (self.level.time * 5)
+        hit_list = []
+        found = []
 
-    def reset(self):
-        self.hero = Character(bunny_images)
-        self.current_level = 0
-        self.start()
-        self.stage = Game.SPLASH
+        left = max(rect.left // GRID_SIZE, 0)
+        right = min((rect.right - 1) // GRID_SIZE, self.cols - 1)
+        top = max(rect.top // GRID_SIZE, 0)
+        bottom = min((rect.bottom - 1) // GRID_SIZE, self.rows - 1)
+        span = pygame.Rect(left * GRID_SIZE, top * GRID_SIZE, (right - left + 1) * GRID_SIZE, (bottom - top + 1) * GRID_SIZE)
 
-    def display_splash(self, surface):
-        line1 = Chocolate_Bar_Font.render(TITLE, 1, DARK_BLUE)
-        line2 = Chocolate_Bar_Font.render("Are you up to the challenge?", 1, WHITE)
-        line3 = Chocolate_Bar_Font.render("PRESS ANY KEY TO START", 1, WHITE)
+        for col in range(left, right + 1):
+            column = self.owners[col]
 
-        x1 = WIDTH / 2 - line1.get_width() / 2;
-        y1 = HEIGHT / 3 - line1.get_height() / 2;
+            for row in range(top, bottom + 1):
+                n = column[row]
 
-        x2 = WIDTH / 2 - line2.get_width() / 2;
-        y2 = y1 + line1.get_height() + 16;
+                if n and n not in found:
+                    found.append(n)
+                    hit_list.append(self.colliders[n - 1].clip(span))
 
-        x3 = WIDTH / 2 - line3.get_width() / 2;
-        y3 = HEIGHT - line3.get_height() - 64;
+        return hit_list
 
-        bun_x1 = 64
-        bun_y1 = 64
-        bun_x2 = WIDTH - 128
-        bun_y2 = HEIGHT - 128
+class Columns(dict):
 
-        pygame.draw.rect(surface, PURPLE, [0, 0, WIDTH, HEIGHT])
-        surface.blit(line1, (x1, y1))
-        surface.blit(line2, (x2, y2))
-        surface.blit(line3, (x3, y3))
-        surface.blit(bunny_idle, (bun_x1, bun_y1))
-        surface.blit(bunny_idle, (bun_x1, bun_y2))
-        surface.blit(bunny_idle, (bun_x2, bun_y1))
-        surface.blit(bunny_idle, (bun_x2, bun_y2))
+    # Column store for streamed tiles; columns that aren't loaded read as empty
+    def __init__(self, empty):
+        super().__init__()
+        self.empty = empty
 
-    def display_message(self, surface, primary_text, secondary_text):
-        line1 = Chocolate_Bar_Font.render(primary_text, 1, WHITE)
-        line2 = Chocolate_Bar_Font.render(secondary_text, 1, WHITE)
+    def __missing__(self, col):
+        return self.empty
 
-        x1 = WIDTH / 2 - line1.get_width() / 2;
-        y1 = HEIGHT / 3 - line1.get_height() / 2;
+class StreamingTiles(TileMap):
 
-        x2 = WIDTH / 2 - line2.get_width() / 2;
-        y2 = y1 + line1.get_height() + 16;
+    # Holds only the columns of loaded chunks. Each chunk is merged into rectangles
+    # on its own, so releasing it drops exactly the colliders it added.
+    def __init__(self, cols, rows):
+        self.names = [None]
+        self.cols = cols
+        self.rows = rows
+        self.columns = Columns(bytes(rows))
+        self.owners = Columns(array.array('i', bytes(4 * rows)))
+        self.colliders = {}
+        self.next_collider = 0
 
-        box_x = WIDTH / 2 - line2.get_width() / 2;
-        box_y = HEIGHT / 3 - line1.get_height() / 2;
-        box_w = line2.get_width()
-        box_h = line1.get_height() + line2.get_height() + 16;
+    def number(self, name):
+        if name not in self.names:
+            self.names.append(name)
 
-        pygame.draw.rect(surface, PURPLE, [box_x, box_y, box_w, box_h])
-        surface.blit(line1, (x1, y1))
-        surface.blit(line2, (x2, y2))
+        return self.names.index(name)
 
-    def display_stats(self, surface):
-        hearts_text = Bubblegum_Font.render("Hearts: " + str(self.hero.hearts)+ "/" + str(self.hero.max_hearts), 1, WHITE)
-        lives_text = Bubblegum_Font.render("x  " + str(self.hero.lives), 1, WHITE)
-        score_text = Bubblegum_Font.render("Score: " + str(self.hero.score), 1, WHITE)
-        level_text = Bubblegum_Font.render("Level: " + str(self.current_level + 1), 1, WHITE)
-        coins_text = Bubblegum_Font.render("Coins: " + str(self.hero.coins), 1, WHITE)
-        time_text = Bubblegum_Font.render("Time Remaining: " + str(self.level.time//60), 1, WHITE)
-
-        surface.blit(score_text, (WIDTH - score_text.get_width() - 32, 32))
-        surface.blit(hearts_text, (32, 32))
-        surface.blit(bunny_idle, (32, 64))
-        surface.blit(lives_text, (128, 80))
-        surface.blit(level_text, (32, 128))
-        surface.blit(coins_text, (32, 160))
-        surface.blit(time_text, (32, 192))
-        if self.hero.jetpack_on == True:
-            jetpack_text = Bubblegum_Font.render("Jetpack Time: " + str(self.hero.jetpack_time//60), 1, WHITE)
-            surface.blit(jetpack_text, (32, 224))
-        else:
-            pass
-        
-    def display_credits(self, surface):
-        line1 = Chocolate_Bar_Font.render("CONGRATULATIONS!", 1, WHITE)
-        line2 = Chocolate_Bar_Font.render("You are the ultImate bunny runner", 1, WHITE)
-        line3 = Chocolate_Bar_Font.render("Score: " + str(self.hero.score), 1, WHITE)
-        line4 = Chocolate_Bar_Font.render("Press R to Run AgaIn", 1, WHITE)
-        line5 = Bubblegum_Font.render("Bunny Run created by: Casey Groves", 1, WHITE)
+    def add(self, first, columns):
+        # Returns the numbers of the new rectangles, for release()
+        for i, column in enumerate(columns):
+            self.columns[first + i] = column
 
-        x1 = WIDTH / 2 - line1.get_width() / 2;
-        y1 = HEIGHT / 5;
+        colliders, owners = merge_cells(self.columns, first, first + len(columns), self.rows, self.next_collider)
+        numbers = range(self.next_collider, self.next_collider + len(colliders))
 
-        x2 = WIDTH / 2 - line2.get_width() / 2;
-        y2 = y1 + line2.get_height() + 16;
+        self.owners.update(owners)
+        self.colliders.update(zip(numbers, colliders))
+        self.next_collider += len(colliders)
 
-        x3 = WIDTH / 2 - line3.get_width() / 2;
-        y3 = y2 + line3.get_height() + 16;
+        return numbers
 
-        x4 = WIDTH / 2 - line4.get_width() / 2;
-        y4 = y3 + line4.get_height() + 16;
+    def release(self, first, last, numbers):
+        for col in range(first, last):
+            self.columns.pop(col, None)
+            self.owners.pop(col, None)
 
-        x5 = WIDTH / 2 - line5.get_width() / 2;
-        y5 = y4 + line5.get_height() + 64;
+        for n in numbers:
+            del self.colliders[n]
 
-        pygame.draw.rect(surface, PURPLE, [0, 0, WIDTH, HEIGHT])
-        surface.blit(line1, (x1, y1))
-        surface.blit(line2, (x2, y2))
-        surface.blit(line3, (x3, y3))
-        surface.blit(line4, (x4, y4))
-        surface.blit(line5, (x5, y5))
+    def report(self):
+        cells = sum(self.rows - column.count(0) for column in self.columns.values())
 
-    def process_events(self):
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                self.done = True
+        return "Colliders: {} cells in {} loaded columns merged into {} rectangles".format(
+            cells, len(self.columns), len(self.colliders))
 
-            elif event.type == pygame.KEYDOWN:
-                if self.stage == Game.SPLASH or self.stage == Game.START:
-                    self.stage = Game.PLAYING
-                    play_music()
+class SpatialHash():
 
-                elif self.stage == Game.PLAYING:
-                    if event.key == JUMP:
-                        self.hero.jump(self.level.blocks)
-                    if event.key == pygame.K_f:
-                        self.hero.speed = 10
-                    elif event.key != pygame.K_f:
-                        self.hero.speed = 5
+    def __init__(self, cell_size=4 * GRID_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.keys = {}
+        self.order = {}
+        self.added = 0
+        self.killed = []
 
-                elif self.stage == Game.PAUSED:
-                    pass
+    def __len__(self):
+        return len(self.keys)
 
-                elif self.stage == Game.LEVEL_COMPLETED:
-                    self.advance()
+    def __contains__(self, sprite):
+        return sprite in self.keys
 
-                elif self.stage == Game.VICTORY or self.stage == Game.GAME_OVER:
-                    if event.key == pygame.K_r:
-                        self.reset()
+    def cells_for(self, rect):
+        size = self.cell_size
+        cols = range(rect.left // size, (rect.right - 1) // size + 1)
+        rows = range(rect.top // size, (rect.bottom - 1) // size + 1)
 
-        pressed = pygame.key.get_pressed()
+        return [(col, row) for col in cols for row in rows]
 
-        if self.stage == Game.PLAYING:
-            if self.hero.jetpack_on == False:
-                if pressed[LEFT]:
-                    self.hero.move_left()
-                elif pressed[RIGHT]:
-                    self.hero.move_right()
-                else:
-                    self.hero.stop()
-            else:
-                pass
+    def add(self, *sprites):
+        for sprite in sprites:
+            self.remove(sprite)
 
-    def update(self):
-        if self.stage == Game.PLAYING:
-            self.hero.update(self.level)
-            self.level.enemies.update(self.level, self.hero)
-            self.level.calculate_time()
-            if self.hero.jetpack_on == True:
-                self.hero.calculate_jetpack_time()
-            else:
-                pass
+            if sprite not in self.order:
+                self.order[sprite] = self.added
+                self.added += 1
 
-        if self.level.completed:
-            if self.current_level < len(levels) - 1:
-                self.stage = Game.LEVEL_COMPLETED
-            else:
-                self.stage = Game.VICTORY
-            pygame.mixer.music.stop()
+            keys = self.cells_for(sprite.rect)
+            self.keys[sprite] = keys
 
-        elif self.hero.lives == 0 or self.level.time == 0:
-            self.stage = Game.GAME_OVER
-            pygame.mixer.music.stop()
+            for key in keys:
+                self.cells.setdefault(key, {})[sprite] = True
 
-        elif self.hero.hearts == 0:
-            self.level.reset()
-            self.hero.respawn(self.level)
+    def remove(self, sprite):
+        keys = self.keys.pop(sprite, None)
 
-    def calculate_offset(self):
-        x = -1 * self.hero.rect.centerx + WIDTH / 2
+        if keys is not None:
+            for key in keys:
+                cell = self.cells[key]
+                del cell[sprite]
 
-        if self.hero.rect.centerx < WIDTH / 2:
-            x = 0
-        elif self.hero.rect.centerx > self.level.width - WIDTH / 2:
-            x = -1 * self.level.width + WIDTH
+                if len(cell) == 0:
+                    del self.cells[key]
 
-        return x, 0
+    def forget(self, sprite):
+        # For sprites that are gone for good, so the hash doesn't keep them alive
+        self.remove(sprite)
+        self.order.pop(sprite, None)
 
-    def draw(self):
-        offset_x, offset_y = self.calculate_offset()
+    def move(self, sprite):
+        # Only touches the hash when the sprite has crossed into different cells
+        if self.keys.get(sprite) != self.cells_for(sprite.rect):
+            self.add(sprite)
 
-        self.level.active_layer.fill(TRANSPARENT)
-        self.level.active_sprites.draw(self.level.active_layer)
+    def query(self, rect):
+        found = {}
 
-        if self.hero.invincibility % 3 < 2:
-            self.level.active_layer.blit(self.hero.image, [self.hero.rect.x, self.hero.rect.y])
+        for key in self.cells_for(rect):
+            cell = self.cells.get(key)
 
-        self.window.blit(self.level.background_layer, [offset_x / 3, offset_y])
-        self.window.blit(self.level.scenery_layer, [offset_x / 2, offset_y])
-        self.window.blit(self.level.inactive_layer, [offset_x, offset_y])
-        self.window.blit(self.level.active_layer, [offset_x, offset_y])
+            if cell is not None:
+                found.update(cell)
 
-        self.display_stats(self.window)
+        return sorted(found, key=self.order.get)
 
-        if self.stage == Game.SPLASH:
-            self.display_splash(self.window)
-        elif self.stage == Game.START:
-            self.display_message(self.window, "Ready?!!!", "Press any key to start")
-        elif self.stage == Game.PAUSED:
-            pass
-        elif self.stage == Game.LEVEL_COMPLETED:
-            self.display_message(self.window, "Level Complete", "Press any key to continue")
-        elif self.stage == Game.VICTORY:
-            self.display_credits(self.window)
-        elif self.stage == Game.GAME_OVER:
-            self.display_message(self.window, "Game Over", "Press 'R' to restart")
+    def near(self, rect, distance):
+        return self.query(rect.inflate(2 * distance, 2 * distance))
 
-        pygame.display.flip()
+    def collide(self, sprite, dokill):
+        hit_list = [s for s in self.query(sprite.rect) if sprite.rect.colliderect(s.rect)]
 
-    def loop(self):
-        while not self.done:
-            self.process_events()
-            self.update()
-            self.draw()
-            self.clock.tick(FPS)
+        if dokill:
+            for s in hit_list:
+                s.kill()
+                self.remove(s)
 
-if __name__ == "__main__":
-    game = Game()
-    game.start()
-    game.loop()
+            # Read and cleared by Level.flush, so snapshots know what was collected
+            self.killed.extend(hit_list)
+
+        return hit_list
+
+class ChunkCache():
+
+    def __init__(self, level, budget=None):
+        if budget is None:
+            budget = chunk_cache_mb * 1024 * 1024
+
+        self.level = level
+        self.chunks = collections.OrderedDict()
+        self.chunk_bytes = CHUNK_WIDTH * level.height * 4
+
+        # Never hold fewer chunks than the screen can overlap plus one on each side
+        min_chunks = WIDTH // CHUNK_WIDTH + 4
+        self.capacity = max(budget // self.chunk_bytes, min_chunks)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def render(self, index):
+        x = index * CHUNK_WIDTH
+        w = min(CHUNK_WIDTH, self.level.width - x)
+        chunk = pygame.Surface([w, self.level.height], pygame.SRCALPHA, 32)
+
+        tiles = self.level.tiles
+        first_col = x // GRID_SIZE
+        last_col = min((x + w) // GRID_SIZE, tiles.cols)
+
+        for col in range(first_col, last_col):
+            for row in range(tiles.rows):
+                name = tiles.get(col, row)
+
+                if name is not None:
+                    chunk.blit(block_images[name], [col * GRID_SIZE - x, row * GRID_SIZE])
+
+        for f in self.level.flag:
+            if f.rect.right > x and f.rect.left < x + w:
+                chunk.blit(f.image, [f.rect.x - x, f.rect.y])
+
+        return chunk
+
+    def get(self, index):
+        chunk = self.chunks.get(index)
+
+        if chunk is not None:
+            self.hits += 1
+            self.chunks.move_to_end(index)
+        else:
+            self.misses += 1
+            chunk = self.render(index)
+            self.chunks[index] = chunk
+
+            while len(self.chunks) > self.capacity:
+                self.chunks.popitem(last=False)
+                self.evictions += 1
+
+        return chunk
+
+    def invalidate(self, index):
+        self.chunks.pop(index, None)
+
+    def draw(self, surface, offset_x, offset_y):
+        last_chunk = (self.level.width - 1) // CHUNK_WIDTH
+        first = max(-offset_x // CHUNK_WIDTH, 0)
+        last = min((-offset_x + WIDTH - 1) // CHUNK_WIDTH, last_chunk)
+
+        for index in range(first, last + 1):
+            surface.blit(self.get(index), [index * CHUNK_WIDTH + offset_x, offset_y])
+
+        # Get the chunks just past each edge of the screen ready before they scroll in
+        for index in (first - 1, last + 1):
+            if 0 <= index <= last_chunk and index not in self.chunks:
+                self.get(index)
+
+    def report(self):
+        return "Tile chunks: {} cached ({:.1f} MB), {} hits, {} misses, {} evictions".format(
+            len(self.chunks), len(self.chunks) * self.chunk_bytes / (1024 * 1024),
+            self.hits, self.misses, self.evictions)
+
+class EnemyArrays():
+
+    # Runs Bear, Monster and FlyMan rules for every enemy at once on NumPy arrays.
+    # Each phase reproduces the per-object update step for step, including the
+    # order the tile hits are visited in, so results match the sprite methods exactly.
+    # It also stands in for the enemy SpatialHash, and only copies state back onto
+    # the sprites that a query actually hands out.
+    def __init__(self, level):
+        self.level = level
+        self.sprites = list(level.starting_enemies)
+        self.index = {e: i for i, e in enumerate(self.sprites)}
+
+        n = len(self.sprites)
+        self.gravity = numpy.array([not isinstance(e, FlyMan) for e in self.sprites], dtype=bool)
+        self.edge_turn = numpy.array([isinstance(e, Monster) for e in self.sprites], dtype=bool)
+        self.frames = numpy.array([len(e.images_right) for e in self.sprites], dtype=numpy.int64)
+        self.w = numpy.array([e.rect.width for e in self.sprites], dtype=numpy.int64)
+        self.h = numpy.array([e.rect.height for e in self.sprites], dtype=numpy.int64)
+
+        self.x = numpy.zeros(n, dtype=numpy.int64)
+        self.y = numpy.zeros(n, dtype=numpy.int64)
+        self.vx = numpy.zeros(n, dtype=numpy.int64)
+        self.vy = numpy.zeros(n, dtype=numpy.float64)
+        self.steps = numpy.zeros(n, dtype=numpy.int64)
+        self.image_index = numpy.zeros(n, dtype=numpy.int64)
+        self.facing_right = numpy.zeros(n, dtype=bool)
+        self.shown_right = numpy.zeros(n, dtype=bool)
+        self.shown_index = numpy.zeros(n, dtype=numpy.int64)
+        self.stale = numpy.zeros(n, dtype=bool)
+
+        self.load_tiles()
+        self.pull(self.sprites)
+
+    def load_tiles(self):
+        tiles = self.level.tiles
+
+        if tiles.colliders is None:
+            tiles.merge()
+
+        # owner[col, row] is the cell's collider number and box[n] that collider's edges; box[0] is unused
+        owners = b"".join(bytes(owner) for owner in tiles.owners)
+        self.owner = numpy.frombuffer(owners, dtype=numpy.int32).reshape(tiles.cols, tiles.rows)
+        self.box = numpy.zeros((len(tiles.colliders) + 1, 4), dtype=numpy.int64)
+
+        for n, rect in enumerate(tiles.colliders, 1):
+            self.box[n] = (rect.left, rect.top, rect.right, rect.bottom)
+
+    def pull(self, sprites):
+        # Copies sprite state into the arrays after something outside the backend moved them
+        if len(sprites) == 0:
+            return
+
+        idx = [self.index[e] for e in sprites]
+        states = zip(*[e.state() for e in sprites])
+
+        for (name, code), values in zip(Enemy.STATE, states):
+            getattr(self, name)[idx] = values
+
+        self.stale[idx] = False
+
+    def push(self, idx):
+        idx = idx[self.stale[idx]]
+        self.stale[idx] = False
+
+        for i in idx.tolist():
+            e = self.sprites[i]
+            e.rect.x = int(self.x[i])
+            e.rect.y = int(self.y[i])
+            e.vx = int(self.vx[i])
+            e.vy = float(self.vy[i])
+            e.steps = int(self.steps[i])
+            e.image_index = int(self.image_index[i])
+            e.current_images = e.images_right if self.facing_right[i] else e.images_left
+            shown = e.images_right if self.shown_right[i] else e.images_left
+            e.image = shown[self.shown_index[i]]
+
+    def sync(self):
+        self.push(numpy.arange(len(self.sprites)))
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def __contains__(self, sprite):
+        return sprite in self.index
+
+    def add(self, *sprites):
+        self.pull(sprites)
+
+    def move(self, sprite):
+        self.pull([sprite])
+
+    def query(self, rect):
+        hit = ((self.x < rect.right) & (self.x + self.w > rect.left) &
+               (self.y < rect.bottom) & (self.y + self.h > rect.top))
+        idx = numpy.nonzero(hit)[0]
+        self.push(idx)
+
+        return [self.sprites[i] for i in idx.tolist()]
+
+    def near(self, rect, distance):
+        return self.query(rect.inflate(2 * distance, 2 * distance))
+
+    def collide(self, sprite, dokill):
+        return self.query(sprite.rect)
+
+    def slots(self, x, y, w, h):
+        # The colliders TileMap.collide would return, in the same order: each of the up to
+        # four cells under an enemy, column-major, skipping colliders already returned
+        cols, rows = self.owner.shape
+        left = numpy.maximum(x // GRID_SIZE, 0)
+        right = numpy.minimum((x + w - 1) // GRID_SIZE, cols - 1)
+        top = numpy.maximum(y // GRID_SIZE, 0)
+        bottom = numpy.minimum((y + h - 1) // GRID_SIZE, rows - 1)
+
+        result = []
+        seen = []
+
+        for dc, dr in ((0, 0), (0, 1), (1, 0), (1, 1)):
+            col = left + dc
+            row = top + dr
+            valid = (col <= right) & (row <= bottom)
+            owner = numpy.where(valid, self.owner[numpy.where(valid, col, 0), numpy.where(valid, row, 0)], 0)
+            hit = owner > 0
+
+            for earlier in seen:
+                hit &= owner != earlier
+
+            seen.append(owner)
+            box = self.box[owner]
+
+            # Cut to the cells under the enemy, like TileMap.collide
+            result.append((hit, numpy.maximum(box[:, 0], left * GRID_SIZE), numpy.maximum(box[:, 1], top * GRID_SIZE),
+                           numpy.minimum(box[:, 2], (right + 1) * GRID_SIZE), numpy.minimum(box[:, 3], (bottom + 1) * GRID_SIZE)))
+
+        return result
+
+    def reverse(self, a, mask):
+        a["vx"] = numpy.where(mask, -a["vx"], a["vx"])
+        a["facing_right"] = numpy.where(mask, a["vx"] >= 0, a["facing_right"])
+        a["shown_right"] = numpy.where(mask, a["facing_right"], a["shown_right"])
+        a["shown_index"] = numpy.where(mask, a["image_index"], a["shown_index"])
+
+    def update(self, hero, awake):
+        level = self.level
+        idx = numpy.fromiter(awake, dtype=numpy.int64, count=len(awake))
+        idx = idx[numpy.abs(self.x[idx] - hero.rect.x) < 2 * WIDTH]
+
+        if len(idx) == 0:
+            return
+
+        names = ("x", "y", "vx", "vy", "steps", "image_index", "facing_right", "shown_right", "shown_index")
+        a = {name: getattr(self, name)[idx] for name in names}
+        w = self.w[idx]
+        h = self.h[idx]
+        gravity = self.gravity[idx]
+        edge_turn = self.edge_turn[idx]
+
+        # apply_gravity
+        a["vy"] = numpy.where(gravity, numpy.minimum(a["vy"] + level.gravity, level.terminal_velocity), a["vy"])
+
+        # move_and_process_blocks, horizontal pass
+        a["x"] = a["x"] + a["vx"]
+
+        for hit, box_left, box_top, box_right, box_bottom in self.slots(a["x"], a["y"], w, h):
+            right = hit & (a["vx"] > 0)
+            left = hit & (a["vx"] < 0)
+            a["x"] = numpy.where(right, box_left - w, numpy.where(left, box_right, a["x"]))
+            self.reverse(a, right | left)
+
+        # Vertical pass. Rect assignment rounds halves away from zero.
+        y = a["y"] + a["vy"]
+        a["y"] = (numpy.sign(y) * numpy.floor(numpy.abs(y) + 0.5)).astype(numpy.int64)
+        turn = edge_turn.copy()
+
+        for hit, box_left, box_top, box_right, box_bottom in self.slots(a["x"], a["y"], w, h):
+            down = hit & numpy.where(edge_turn, a["vy"] >= 0, a["vy"] > 0)
+            up = hit & (a["vy"] < 0)
+            a["y"] = numpy.where(down, box_top - h, numpy.where(up, box_bottom, a["y"]))
+            a["vy"] = numpy.where(down | up, 0.0, a["vy"])
+
+            supported = (((a["vx"] > 0) & (a["x"] + w <= box_right)) |
+                         ((a["vx"] < 0) & (a["x"] >= box_left)))
+            turn &= ~(down & supported)
+
+        self.reverse(a, turn)
+
+        # check_world_boundaries
+        past_left = a["x"] < 0
+        past_right = ~past_left & (a["x"] + w > level.width)
+        a["x"] = numpy.where(past_left, 0, numpy.where(past_right, level.width - w, a["x"]))
+        self.reverse(a, past_left | past_right)
+
+        # set_images
+        first_step = a["steps"] == 0
+        a["shown_right"] = numpy.where(first_step, a["facing_right"], a["shown_right"])
+        a["shown_index"] = numpy.where(first_step, a["image_index"], a["shown_index"])
+        a["image_index"] = numpy.where(first_step, (a["image_index"] + 1) % self.frames[idx], a["image_index"])
+        a["steps"] = (a["steps"] + 1) % 20
+
+        for name in names:
+            getattr(self, name)[idx] = a[name]
+
+        self.stale[idx] = True
+
+class EnemyScheduler():
+
+    # Buckets enemies into SECTOR_WIDTH columns and only hands out the ones in sectors
+    # that can hold an enemy within 2 * WIDTH of the hero. Everything else stays dormant.
+    # With the arrays backend, positions(indices) gives many x values at once so settle()
+    # can find sector changes without a Python call per enemy.
+    def __init__(self, items, position, positions=None):
+        self.items = items
+        self.position = position
+        self.positions = positions
+        self.rebuild()
+
+    def rebuild(self):
+        self.sectors = {}
+        self.home = {}
+        self.window = None
+        self.awake = []
+
+        for item in self.items:
+            self.put(item, self.position(item) // SECTOR_WIDTH)
+
+    def put(self, item, sector):
+        self.home[item] = sector
+        self.sectors.setdefault(sector, {})[item] = True
+
+    def wake(self, hero):
+        x = hero.rect.x
+        window = ((x - 2 * WIDTH + 1) // SECTOR_WIDTH, (x + 2 * WIDTH - 1) // SECTOR_WIDTH)
+
+        if window != self.window:
+            self.window = window
+            self.awake = [item for sector in range(window[0], window[1] + 1)
+                          for item in self.sectors.get(sector, ())]
+
+            if self.positions is not None:
+                self.awake_index = numpy.array(self.awake, dtype=numpy.int64)
+                self.awake_home = numpy.array([self.home[i] for i in self.awake], dtype=numpy.int64)
+
+        return self.awake
+
+    def move(self, item):
+        # Re-buckets one enemy if it's now in a different sector
+        sector = self.position(item) // SECTOR_WIDTH
+        home = self.home[item]
+
+        if sector != home:
+            del self.sectors[home][item]
+            self.put(item, sector)
+            self.window = None
+
+    def add(self, item):
+        # add and remove are for levels that stream enemies in and out. They don't
+        # touch items, so rebuild() afterwards would lose them.
+        self.put(item, self.position(item) // SECTOR_WIDTH)
+        self.window = None
+
+    def remove(self, item):
+        sector = self.home.pop(item)
+        del self.sectors[sector][item]
+
+        if len(self.sectors[sector]) == 0:
+            del self.sectors[sector]
+
+        self.window = None
+
+    def settle(self):
+        # Re-buckets awake enemies that walked over a sector edge
+        if self.positions is not None:
+            if len(self.awake) > 0:
+                sectors = self.positions(self.awake_index) // SECTOR_WIDTH
+
+                for k in numpy.flatnonzero(sectors != self.awake_home):
+                    self.move(self.awake[k])
+
+            return
+
+        for item in self.awake:
+            self.move(item)
+
+    def report(self):
+        active = len(self.awake)
+        awake_sectors = 0
+
+        if self.window is not None:
+            awake_sectors = len([s for s in self.sectors if self.window[0] <= s <= self.window[1]])
+
+        return "Enemies: {} active, {} dormant, {} of {} sectors awake".format(
+            active, len(self.home) - active, awake_sectors, len(self.sectors))
+
+class ParallaxLayer():
+
+    # Keeps one copy of the layer's image and blits only the copies that cover the screen
+    def __init__(self, map_data, name, width, height):
+        self.width = width
+        self.height = height
+        self.color = None
+        self.img = None
+        self.repeat = False
+        self.start_y = 0
+
+        if name == 'background' and map_data['background-color'] != "":
+            self.color = map_data['background-color']
+
+        if map_data[name + '-img'] != "":
+            img = pygame.image.load(map_data[name + '-img'])
+
+            if map_data[name + '-fill-y']:
+                h = img.get_height()
+                w = int(img.get_width() * HEIGHT / h)
+                img = pygame.transform.scale(img, (w, HEIGHT))
+
+            if "top" in map_data[name + '-position']:
+                self.start_y = 0
+            elif "bottom" in map_data[name + '-position']:
+                self.start_y = height - img.get_height()
+
+            self.img = img
+            self.repeat = bool(map_data[name + '-repeat-x'])
+
+    def draw(self, surface, x, y):
+        x, y = int(x), int(y)
+        bounds = pygame.Rect(x, y, self.width, self.height).clip(surface.get_clip())
+
+        if bounds.width == 0 or bounds.height == 0:
+            return
+
+        if self.color is not None:
+            surface.fill(self.color, bounds)
+
+        if self.img is not None:
+            w = self.img.get_width()
+
+            if self.repeat:
+                first = (bounds.left - x) // w
+                last = (bounds.right - 1 - x) // w
+            else:
+                first = last = 0
+
+            # Copies stop at the level's edges, as they did on a level-sized surface
+            clip = surface.get_clip()
+            surface.set_clip(bounds)
+
+            for i in range(first, last + 1):
+                surface.blit(self.img, [x + i * w, y + self.start_y])
+
+            surface.set_clip(clip)
+
+def compiled_path(file_path):
+    # Keyed on the full path too, so levels/world-1.json and mods/world-1.json don't share a file
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    key = hashlib.sha1(os.path.abspath(file_path).encode()).hexdigest()[:12]
+    return os.path.join(LEVEL_CACHE, "{}-{}.lvl".format(name, key))
+
+def source_stamps(paths):
+    stamps = {}
+
+    for path in paths:
+        if path != "":
+            info = os.stat(path)
+            stamps[path] = [info.st_mtime_ns, info.st_size]
+
+    return stamps
+
+def file_stamp(path):
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+
+    return (info.st_mtime_ns, info.st_size)
+
+# A compiled level is a JSON header followed by the raw tile grid, one int32 (x, y)
+# table per entity kind.
+def compile_level(file_path, out_path):
+    with open(file_path, 'r') as f:
+        map_data = json.loads(f.read())
+
+    tiles = TileMap(map_data['blocks'], map_data['width'], map_data['height'])
+
+    colliders = array.array('i', [v for rect in tiles.colliders for v in rect])
+    sections = [('tiles', b"".join(tiles.columns)),
+                ('colliders', colliders.tobytes()),
+                ('owners', b"".join(owner.tobytes() for owner in tiles.owners))]
+
+    for kind in ENTITY_KINDS:
+        table = array.array('i', [v for item in map_data[kind] for v in item[:2]])
+        sections.append((kind, table.tobytes()))
+
+    header = {k: v for k, v in map_data.items() if k != 'blocks' and k not in ENTITY_KINDS}
+    header['build'] = [LEVEL_VERSION, GRID_SIZE, HEIGHT, sys.byteorder]
+    header['sources'] = source_stamps([file_path])
+    header['tile-names'] = tiles.names
+    header['tile-grid'] = [tiles.cols, tiles.rows]
+    header['sections'] = {}
+
+    offset = 0
+
+    for name, data in sections:
+        header['sections'][name] = [offset, len(data)]
+        offset += (len(data) + 15) // 16 * 16
+
+    header_data = json.dumps(header).encode()
+    base = (8 + len(header_data) + 15) // 16 * 16
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+    # Each writer gets its own temp file, so batch workers and the prefetcher compiling
+    # the same level at once can't write into each other's file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(out_path), suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(LEVEL_MAGIC + struct.pack('<I', len(header_data)) + header_data)
+
+            for name, data in sections:
+                f.seek(base + header['sections'][name][0])
+                f.write(data)
+
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def load_compiled(path):
+    # Any damage to the file comes out as ValueError, so callers can just compile it again
+    try:
+        return read_compiled(path)
+    except (struct.error, KeyError, IndexError, TypeError) as e:
+        raise ValueError("corrupt compiled level {}: {!r}".format(path, e))
+
+def read_compiled(path):
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mm[:4] != LEVEL_MAGIC:
+        raise ValueError("not a compiled level: " + path)
+
+    header_len = struct.unpack_from('<I', mm, 4)[0]
+    header = json.loads(mm[8:8 + header_len])
+    base = (8 + header_len + 15) // 16 * 16
+    view = memoryview(mm)
+
+    if header['build'] != [LEVEL_VERSION, GRID_SIZE, HEIGHT, sys.byteorder]:
+        return None
+
+    try:
+        if header['sources'] != source_stamps(header['sources']):
+            return None
+    except OSError:
+        return None
+
+    def section(name):
+        offset, length = header['sections'][name]
+
+        if base + offset + length > len(view):
+            raise ValueError("truncated compiled level: " + path)
+
+        return view[base + offset:base + offset + length]
+
+    map_data = {k: v for k, v in header.items() if k not in ('build', 'sources', 'tile-names', 'tile-grid', 'sections')}
+
+    for kind in ENTITY_KINDS:
+        table = section(kind).cast('i').tolist()
+        map_data[kind] = list(zip(table[0::2], table[1::2]))
+
+    cols, rows = header['tile-grid']
+    map_data['tiles'] = TileMap([], 0, 0)
+    map_data['tiles'].load(header['tile-names'], cols, rows, section('tiles'),
+                           section('colliders').cast('i'), section('owners').cast('i'))
+
+    return map_data
+
+def load_map(file_path):
+    if compile_levels:
+        path = compiled_path(file_path)
+
+        try:
+            map_data = load_compiled(path)
+        except (OSError, ValueError):
+            map_data = None
+
+        if map_data is None:
+            try:
+                compile_level(file_path, path)
+                map_data = load_compiled(path)
+            except (OSError, ValueError):
+                map_data = None
+
+        if map_data is not None:
+            return map_data
+
+    with open(file_path, 'r') as f:
+        data = f.read()
+
+    return json.loads(data)
+
+def is_position(item):
+    return isinstance(item, (list, tuple)) and len(item) >= 2 and all(isinstance(v, int) for v in item[:2])
+
+class Snapshot():
+
+    # The mutable state of a level at one moment: enemy fields, which coins and
+    # powerups are still there, and the clock, plus the hero and tick count when
+    # it comes from an Engine. While a snapshot is alive, its Level adds every
+    # enemy and item that changes to dirty, so restoring it only touches those.
+    def __init__(self):
+        self.time = 0
+        self.completed = False
+        self.enemies = {}
+        self.coins = bytearray()
+        self.powerups = bytearray()
+        self.hero = None
+        self.ticks = 0
+        self.layout = None
+        self.dirty = {"enemies": set(), "coins": set(), "powerups": set()}
+
+    def sections(self):
+        return [(name, self.enemies[name]) for name, code in Enemy.STATE] + \
+               [("coins", array.array('B', self.coins)), ("powerups", array.array('B', self.powerups))]
+
+    def save(self, path):
+        sections = self.sections()
+        header = {"version": SNAPSHOT_VERSION, "time": self.time, "completed": self.completed,
+                  "hero": self.hero, "ticks": self.ticks, "sections": {}}
+        offset = 0
+
+        for name, data in sections:
+            header['sections'][name] = [offset, len(data), data.typecode]
+            offset += len(data) * data.itemsize
+
+        header_data = json.dumps(header).encode()
+
+        with open(path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC + struct.pack('<I', len(header_data)) + header_data)
+
+            for name, data in sections:
+                f.write(data.tobytes())
+
+def load_snapshot(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data[:4] != SNAPSHOT_MAGIC:
+        raise ValueError("not a snapshot: " + path)
+
+    header_len = struct.unpack_from('<I', data, 4)[0]
+    header = json.loads(data[8:8 + header_len])
+
+    if header['version'] != SNAPSHOT_VERSION:
+        raise ValueError("unsupported snapshot version: " + str(header['version']))
+
+    snapshot = Snapshot()
+    snapshot.time = header['time']
+    snapshot.completed = header['completed']
+    snapshot.hero = header['hero']
+    snapshot.ticks = header['ticks']
+    base = 8 + header_len
+
+    for name, (offset, length, code) in header['sections'].items():
+        section = array.array(code)
+        section.frombytes(data[base + offset:base + offset + length * section.itemsize])
+
+        if name in ('coins', 'powerups'):
+            setattr(snapshot, name, bytearray(section))
+        else:
+            snapshot.enemies[name] = section
+
+    return snapshot
+
+def present_bits(items, group):
+    bits = bytearray((len(items) + 7) // 8)
+
+    for i, item in enumerate(items):
+        if item in group:
+            bits[i >> 3] |= 1 << (i & 7)
+
+    return bits
+
+class BaseLevel():
+
+    # What every level has, however its tiles and entities get loaded; see Level and StreamingLevel
+
+    # Which starting list each kind of entity goes in and how to make one
+    SPRITES = {'bears': ('enemies', lambda x, y: Bear(x, y, spikeman_images)),
+               'monsters': ('enemies', lambda x, y: Monster(x, y, spikeball_images)),
+               'flyman': ('enemies', lambda x, y: FlyMan(x, y, flyman_images)),
+               'coins': ('coins', lambda x, y: Coin(x, y, item_images["coin"])),
+               'oneups': ('powerups', lambda x, y: OneUp(x, y, item_images["carrot"])),
+               'hearts': ('powerups', lambda x, y: Heart(x, y, item_images["powerup"])),
+               'powerup': ('powerups', lambda x, y: Powerup(x, y, item_images["gold_carrot"])),
+               'bolt': ('powerups', lambda x, y: Bolt(x, y, item_images["bolt"])),
+               'jetpack': ('powerups', lambda x, y: Jetpack(x, y, item_images["jetpack"])),
+               'bubble': ('powerups', lambda x, y: Bubble(x, y, item_images["bubble"])),
+               'flag': ('flag', lambda x, y: Flag(x, y, item_images["portal"]))}
+
+    def setup(self, map_data):
+        # The groups, hashes and settings every level has, before any tiles or entities
+        self.starting_enemies = []
+        self.starting_coins = []
+        self.starting_powerups = []
+        self.starting_flag = []
+
+        self.enemies = pygame.sprite.Group()
+        self.coins = pygame.sprite.Group()
+        self.powerups = pygame.sprite.Group()
+        self.flag = pygame.sprite.Group()
+
+        self.enemy_hash = SpatialHash()
+        self.coin_hash = SpatialHash()
+        self.powerup_hash = SpatialHash()
+        self.flag_hash = SpatialHash()
+
+        self.settings = {k: v for k, v in map_data.items() if k not in ('blocks', 'tiles') and k not in ENTITY_KINDS}
+
+        self.width = map_data['width'] * GRID_SIZE
+        self.height = map_data['height'] * GRID_SIZE
+        self.time_limit = map_data['time'] * FPS
+        self.time = self.time_limit
+
+        self.start_x = map_data['start'][0] * GRID_SIZE
+        self.start_y = map_data['start'][1] * GRID_SIZE
+
+        self.background_layer = ParallaxLayer(map_data, 'background', self.width, self.height)
+        self.scenery_layer = ParallaxLayer(map_data, 'scenery', self.width, self.height)
+
+        self.music = map_data['music']
+
+        self.gravity = map_data['gravity']
+        self.terminal_velocity = map_data['terminal-velocity']
+
+        self.completed = False
+
+    def stream(self, hero):
+        # Everything is loaded up front; see StreamingLevel
+        pass
+
+    def calculate_time(self):
+        self.time -= 1
+        if self.time <= 0:
+            self.time = 0
+
+    def visible_sprites(self, viewport):
+        return (self.coin_hash.query(viewport) +
+                self.enemy_hash.query(viewport) +
+                self.powerup_hash.query(viewport))
+
+    def update_enemies(self, hero):
+        awake = self.scheduler.wake(hero)
+
+        if self.enemy_arrays is not None:
+            self.enemy_arrays.update(hero, awake)
+        else:
+            for e in awake:
+                e.update(self, hero)
+
+        self.scheduler.settle()
+
+    def report(self):
+        return self.tiles.report() + "\n" + self.tile_cache.report() + "\n" + self.scheduler.report()
+
+class Level(BaseLevel):
+
+    def __init__(self, file_path, map_data=None):
+        # map_data may be shared between levels (see bunny_env); it is only ever read
+        self.path = file_path
+        self.stamp = file_stamp(file_path)
+
+        if map_data is None:
+            map_data = load_map(file_path)
+
+        self.setup(map_data)
+
+        if 'tiles' in map_data:
+            self.tiles = map_data['tiles']
+        else:
+            self.tiles = TileMap(map_data['blocks'], map_data['width'], map_data['height'])
+
+        self.placed = {}
+
+        for kind in ENTITY_KINDS:
+            self.placed[kind] = [(tuple(item[:2]), self.spawn(kind, item)) for item in map_data[kind]]
+
+        self.enemies.add(self.starting_enemies)
+        self.coins.add(self.starting_coins)
+        self.powerups.add(self.starting_powerups)
+        self.flag.add(self.starting_flag)
+
+        # The arrays only beat per-sprite updates once enough enemies are awake to cover their per-call cost
+        expected_awake = len(self.starting_enemies) * min(1, 4 * WIDTH / self.width)
+
+        if numpy is not None and vectorized_enemies and expected_awake >= vectorize_min_awake:
+            self.enemy_arrays = EnemyArrays(self)
+            self.enemy_hash = self.enemy_arrays
+        else:
+            self.enemy_arrays = None
+
+        self.enemy_hash.add(*self.starting_enemies)
+        self.coin_hash.add(*self.starting_coins)
+        self.powerup_hash.add(*self.starting_powerups)
+        self.flag_hash.add(*self.starting_flag)
+
+        if self.enemy_arrays is not None:
+            arrays = self.enemy_arrays
+            self.scheduler = EnemyScheduler(range(len(arrays)), lambda i: int(arrays.x[i]), lambda idx: arrays.x[idx])
+        else:
+            self.scheduler = EnemyScheduler(self.starting_enemies, lambda e: e.rect.x)
+
+        self.tile_cache = ChunkCache(self)
+
+        self.enemy_numbers = {e: i for i, e in enumerate(self.starting_enemies)}
+        self.coin_numbers = {c: i for i, c in enumerate(self.starting_coins)}
+        self.powerup_numbers = {p: i for i, p in enumerate(self.starting_powerups)}
+        self.tracked = weakref.WeakSet()
+        self.last_awake = None
+        self.layout = 0
+        self.initial = self.snapshot()
+
+    def spawn(self, kind, item):
+        group, make = Level.SPRITES[kind]
+        sprite = make(item[0] * GRID_SIZE, item[1] * GRID_SIZE)
+        getattr(self, 'starting_' + group).append(sprite)
+
+        return sprite
+
+    def reset(self):
+        self.restore_entities(self.initial)
+
+    def restart(self):
+        # reset() only puts the sprites back after losing a life; this also restarts the clock
+        self.restore(self.initial)
+
+    def flush(self):
+        # Hands the coins and powerups collected since the last call to every live snapshot
+        for name, items, numbers in (("coins", self.coin_hash, self.coin_numbers),
+                                     ("powerups", self.powerup_hash, self.powerup_numbers)):
+            if len(items.killed) > 0:
+                changed = [numbers[item] for item in items.killed]
+
+                for snapshot in self.tracked:
+                    snapshot.dirty[name].update(changed)
+
+                items.killed = []
+
+    def snapshot(self):
+        self.flush()
+
+        snapshot = Snapshot()
+        snapshot.time = self.time
+        snapshot.completed = self.completed
+        snapshot.layout = self.layout
+
+        if self.enemy_arrays is not None:
+            for name, code in Enemy.STATE:
+                values = getattr(self.enemy_arrays, name).astype(code)
+                snapshot.enemies[name] = array.array(code, values.tobytes())
+        else:
+            states = list(zip(*[e.state() for e in self.starting_enemies]))
+
+            for k, (name, code) in enumerate(Enemy.STATE):
+                snapshot.enemies[name] = array.array(code, states[k] if len(states) > 0 else [])
+
+        snapshot.coins = present_bits(self.starting_coins, self.coin_hash)
+        snapshot.powerups = present_bits(self.starting_powerups, self.powerup_hash)
+
+        self.tracked.add(snapshot)
+
+        # Enemies awake right now keep moving, so the next update marks them dirty
+        self.last_awake = None
+
+        return snapshot
+
+    def restore(self, snapshot):
+        self.time = snapshot.time
+        self.completed = snapshot.completed
+        self.restore_entities(snapshot)
+
+    def restore_entities(self, snapshot):
+        self.flush()
+
+        if snapshot.layout is not None and snapshot.layout != self.layout:
+            raise ValueError("snapshot is from before the level was edited")
+
+        if (len(snapshot.enemies["x"]) != len(self.starting_enemies) or
+                len(snapshot.coins) != (len(self.starting_coins) + 7) // 8 or
+                len(snapshot.powerups) != (len(self.starting_powerups) + 7) // 8):
+            raise ValueError("snapshot doesn't match this level")
+
+        if snapshot in self.tracked:
+            dirty = snapshot.dirty
+        else:
+            # Not taken from this level, so anything could differ
+            dirty = {"enemies": set(range(len(self.starting_enemies))),
+                     "coins": set(range(len(self.starting_coins))),
+                     "powerups": set(range(len(self.starting_powerups)))}
+
+        changed = sorted(dirty["enemies"])
+
+        if self.enemy_arrays is not None:
+            arrays = self.enemy_arrays
+            idx = numpy.array(changed, dtype=numpy.int64)
+
+            for name, code in Enemy.STATE:
+                getattr(arrays, name)[idx] = numpy.frombuffer(snapshot.enemies[name], dtype=code)[idx]
+
+            arrays.stale[idx] = True
+
+            for i in changed:
+                self.scheduler.move(i)
+        else:
+            fields = [snapshot.enemies[name] for name, code in Enemy.STATE]
+
+            for i in changed:
+                e = self.starting_enemies[i]
+                e.set_state(*[field[i] for field in fields])
+                self.enemy_hash.move(e)
+                self.scheduler.move(e)
+
+        for name, items, group, items_hash in (("coins", self.starting_coins, self.coins, self.coin_hash),
+                                               ("powerups", self.starting_powerups, self.powerups, self.powerup_hash)):
+            bits = getattr(snapshot, name)
+
+            for i in sorted(dirty[name]):
+                item = items[i]
+
+                if bits[i >> 3] & (1 << (i & 7)):
+                    group.add(item)
+                    items_hash.add(item)
+                else:
+                    item.kill()
+                    items_hash.remove(item)
+
+        # Whatever was just put back has changed for every other live snapshot
+        for other in self.tracked:
+            if other is not snapshot:
+                for name in other.dirty:
+                    other.dirty[name].update(dirty[name])
+
+        if snapshot in self.tracked:
+            snapshot.dirty = {"enemies": set(), "coins": set(), "powerups": set()}
+
+        self.scheduler.window = None
+        self.last_awake = None
+
+    def patch(self, map_data):
+        # Applies an edited copy of the level's JSON in place. Only changed tiles and
+        # entities are touched; everything else, including enemies mid-walk, carries on.
+        # Returns a summary, or None if the level changed size and needs loading again.
+        # The whole map is read and checked before anything changes, so a bad file
+        # raises and leaves the level exactly as it was.
+        tiles = self.tiles
+
+        for item in map_data['blocks']:
+            if not (isinstance(item, list) and len(item) == 3 and is_position(item)):
+                raise ValueError("bad block {!r}".format(item))
+            if not isinstance(item[2], str) or item[2] not in block_images:
+                raise ValueError("unknown block {!r}".format(item[2]))
+
+        cols = max([map_data['width']] + [item[0] + 1 for item in map_data['blocks']])
+        rows = max([map_data['height']] + [item[1] + 1 for item in map_data['blocks']])
+
+        if (map_data['width'] * GRID_SIZE != self.width or map_data['height'] * GRID_SIZE != self.height or
+                cols != tiles.cols or rows != tiles.rows):
+            return None
+
+        # Tiles: lay the new blocks out the way TileMap stores them and compare column by column
+        lookup = {name: i for i, name in enumerate(tiles.names)}
+        names = list(tiles.names)
+        columns = [bytearray(rows) for col in range(cols)]
+
+        for col, row, name in map_data['blocks']:
+            if col >= 0 and row >= 0:
+                if name not in lookup:
+                    lookup[name] = len(names)
+                    names.append(name)
+
+                columns[col][row] = lookup[name]
+
+        changed_cells = [(col, row) for col in range(cols) if columns[col] != tiles.columns[col]
+                         for row in range(rows) if columns[col][row] != tiles.columns[col][row]]
+        dirty_chunks = set(col * GRID_SIZE // CHUNK_WIDTH for col, row in changed_cells)
+
+        # Entities: keep the sprite already standing on each unchanged spot, in file order
+        placements = {}
+        added = []
+        removed = []
+
+        for kind in ENTITY_KINDS:
+            group, make = Level.SPRITES[kind]
+
+            for item in map_data[kind]:
+                if not is_position(item):
+                    raise ValueError("bad {} position {!r}".format(kind, item))
+
+            positions = [tuple(item[:2]) for item in map_data[kind]]
+
+            if positions == [pos for pos, sprite in self.placed[kind]]:
+                continue
+
+            spare = {}
+
+            for pos, sprite in self.placed[kind]:
+                spare.setdefault(pos, []).append(sprite)
+
+            placed = []
+
+            for pos in positions:
+                if len(spare.get(pos, ())) > 0:
+                    sprite = spare[pos].pop(0)
+                else:
+                    sprite = make(pos[0] * GRID_SIZE, pos[1] * GRID_SIZE)
+                    added.append((group, sprite))
+
+                placed.append((pos, sprite))
+
+            removed.extend((group, sprite) for sprites in spare.values() for sprite in sprites)
+            placements[kind] = placed
+
+        # Settings
+        layers = {}
+
+        for name in ('background', 'scenery'):
+            keys = [k for k in map_data if k.startswith(name + '-')]
+
+            if any(map_data[k] != self.settings.get(k) for k in keys):
+                layers[name] = ParallaxLayer(map_data, name, self.width, self.height)
+
+        if not (is_position(map_data['start']) and all(isinstance(map_data[k], (int, float))
+                                                       for k in ('time', 'gravity', 'terminal-velocity'))):
+            raise ValueError("bad time, start, gravity or terminal-velocity")
+
+        time_limit = map_data['time'] * FPS
+        start_x = map_data['start'][0] * GRID_SIZE
+        start_y = map_data['start'][1] * GRID_SIZE
+
+        # Everything checked out; from here on the level changes
+        self.flush()
+
+        if self.enemy_arrays is not None:
+            self.enemy_arrays.sync()
+
+        for col, row in changed_cells:
+            tiles.set(col, row, names[columns[col][row]])
+
+        if len(changed_cells) > 0:
+            tiles.merge()
+
+            if self.enemy_arrays is not None:
+                self.enemy_arrays.load_tiles()
+
+        old_enemies = list(self.starting_enemies)
+        hashes = {'enemies': self.enemy_hash, 'coins': self.coin_hash,
+                  'powerups': self.powerup_hash, 'flag': self.flag_hash}
+        changed_groups = set(Level.SPRITES[kind][0] for kind in placements)
+        self.placed.update(placements)
+
+        for group in changed_groups:
+            setattr(self, 'starting_' + group, [sprite for kind in ENTITY_KINDS if Level.SPRITES[kind][0] == group
+                                                for pos, sprite in self.placed[kind]])
+
+        for group, sprite in removed:
+            sprite.kill()
+
+            if group != 'enemies' or self.enemy_arrays is None:
+                hashes[group].remove(sprite)
+
+        for group, sprite in added:
+            getattr(self, group).add(sprite)
+
+            if group != 'enemies' or self.enemy_arrays is None:
+                hashes[group].add(sprite)
+
+        for group, sprite in removed + added:
+            if group == 'flag':
+                dirty_chunks.update(range(sprite.rect.left // CHUNK_WIDTH, (sprite.rect.right - 1) // CHUNK_WIDTH + 1))
+
+        if 'enemies' in changed_groups:
+            if self.enemy_arrays is not None:
+                self.enemy_arrays = EnemyArrays(self)
+                self.enemy_hash = self.enemy_arrays
+                arrays = self.enemy_arrays
+                self.scheduler = EnemyScheduler(range(len(arrays)), lambda i: int(arrays.x[i]), lambda idx: arrays.x[idx])
+            else:
+                self.scheduler = EnemyScheduler(self.starting_enemies, lambda e: e.rect.x)
+
+        for index in dirty_chunks:
+            self.tile_cache.invalidate(index)
+
+        for name, layer in layers.items():
+            setattr(self, name + '_layer', layer)
+
+        self.settings = {k: v for k, v in map_data.items() if k != 'blocks' and k not in ENTITY_KINDS}
+        self.time_limit = time_limit
+        self.start_x = start_x
+        self.start_y = start_y
+        self.gravity = map_data['gravity']
+        self.terminal_velocity = map_data['terminal-velocity']
+
+        if len(changed_groups) > 0:
+            self.renumber(old_enemies)
+
+        self.initial.time = self.time_limit
+
+        return "{} tiles changed, {} sprites added, {} removed".format(len(changed_cells), len(added), len(removed))
+
+    def renumber(self, old_enemies):
+        # The entity lists changed, so every index-based record is rebuilt. The starting
+        # snapshot keeps its values for enemies that stayed and takes new ones as they are now.
+        self.enemy_numbers = {e: i for i, e in enumerate(self.starting_enemies)}
+        self.coin_numbers = {c: i for i, c in enumerate(self.starting_coins)}
+        self.powerup_numbers = {p: i for i, p in enumerate(self.starting_powerups)}
+        self.coin_hash.killed = []
+        self.powerup_hash.killed = []
+
+        old_numbers = {e: i for i, e in enumerate(old_enemies)}
+        old = self.initial
+        initial = Snapshot()
+        initial.time = self.time_limit
+        initial.coins = present_bits(self.starting_coins, self.coin_numbers)
+        initial.powerups = present_bits(self.starting_powerups, self.powerup_numbers)
+
+        fresh = {e: e.state() for e in self.starting_enemies if e not in old_numbers}
+
+        for k, (name, code) in enumerate(Enemy.STATE):
+            values = old.enemies[name]
+            initial.enemies[name] = array.array(code, [values[old_numbers[e]] if e in old_numbers else fresh[e][k]
+                                                       for e in self.starting_enemies])
+
+        # Snapshots taken before now number things differently, so they're no longer tracked,
+        # and the live state may differ from the new starting snapshot anywhere
+        self.layout += 1
+        initial.layout = self.layout
+        initial.dirty = {"enemies": set(range(len(self.starting_enemies))),
+                         "coins": set(range(len(self.starting_coins))),
+                         "powerups": set(range(len(self.starting_powerups)))}
+        self.initial = initial
+        self.tracked = weakref.WeakSet([initial])
+        self.last_awake = None
+
+    def update_enemies(self, hero):
+        awake = self.scheduler.wake(hero)
+
+        # Only enemies in the awake list can move, and it's a new list whenever it changes
+        if awake is not self.last_awake and len(self.tracked) > 0:
+
+            if self.enemy_arrays is None:
+                changed = [self.enemy_numbers[e] for e in awake]
+            else:
+                changed = awake
+
+            for snapshot in self.tracked:
+                snapshot.dirty["enemies"].update(changed)
+
+        self.last_awake = awake
+        super().update_enemies(hero)
+
+class StreamingLevel(BaseLevel):
+
+    # A level split into column chunks by make_level.py --stream. Only the chunks around
+    # the hero are in memory: ones coming up are read on a worker thread and built a few
+    # sprites at a time, for at most stream_budget_ms a tick, and ones far behind are
+    # dropped. Chunks within reach of anything that can move are always finished before
+    # the tick that needs them, so play never depends on how quickly loading went.
+    # Collected items stay collected when a chunk comes back; its enemies start over.
+    def __init__(self, path):
+        self.path = path
+        self.stamp = file_stamp(path)
+
+        with open(os.path.join(path, STREAM_HEADER), 'r') as f:
+            header = json.loads(f.read())
+
+        self.setup(header)
+        self.chunk_cols = header['chunk-columns']
+        self.chunk_count = header['chunks']
+
+        self.tiles = StreamingTiles(header['tile-columns'], header['tile-rows'])
+        self.enemy_arrays = None
+        self.scheduler = EnemyScheduler([], lambda e: e.rect.x)
+        self.tile_cache = ChunkCache(self)
+        self.hashes = {'enemies': self.enemy_hash, 'coins': self.coin_hash,
+                       'powerups': self.powerup_hash, 'flag': self.flag_hash}
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.chunks = {}
+        self.building = {}
+        self.taken = set()
+        self.item_keys = {}
+        self.loads = 0
+        self.stalls = 0
+
+    def chunk_range(self, left, right):
+        # Indices of the chunks overlapping pixels left to right
+        size = self.chunk_cols * GRID_SIZE
+
+        return range(max(left // size, 0), min((right - 1) // size, self.chunk_count - 1) + 1)
+
+    def read(self, index):
+        with open(os.path.join(self.path, STREAM_CHUNK.format(index)), 'r') as f:
+            return json.loads(f.read())
+
+    def build(self, index, future):
+        # A generator, so the work can stop after any step and carry on next tick
+        data = future.result()
+        tiles = self.tiles
+        first = index * self.chunk_cols
+        last = min(first + self.chunk_cols, tiles.cols)
+        columns = [bytearray(tiles.rows) for col in range(first, last)]
+
+        for col, row, name in data['blocks']:
+            if first <= col < last and 0 <= row < tiles.rows:
+                columns[col - first][row] = tiles.number(name)
+
+        chunk = {'columns': (first, last), 'colliders': tiles.add(first, columns), 'sprites': []}
+        self.chunks[index] = chunk
+        self.invalidate(chunk)
+        yield
+
+        for kind in ENTITY_KINDS:
+            group, make = BaseLevel.SPRITES[kind]
+
+            for i, item in enumerate(data.get(kind, [])):
+                key = (index, kind, i)
+
+                if key in self.taken:
+                    continue
+
+                sprite = make(item[0] * GRID_SIZE, item[1] * GRID_SIZE)
+                getattr(self, group).add(sprite)
+                self.hashes[group].add(sprite)
+                chunk['sprites'].append((group, sprite))
+
+                if group == 'enemies':
+                    self.scheduler.add(sprite)
+                elif group != 'flag':
+                    self.item_keys[sprite] = key
+
+                if len(chunk['sprites']) % STREAM_BATCH == 0:
+                    yield
+
+        # The tile cache draws the flag into its chunks
+        if len(data.get('flag', [])) > 0:
+            self.invalidate(chunk)
+
+        self.loads += 1
+
+    def invalidate(self, chunk):
+        first, last = chunk['columns']
+
+        for index in range(first * GRID_SIZE // CHUNK_WIDTH, (last * GRID_SIZE - 1) // CHUNK_WIDTH + 1):
+            self.tile_cache.invalidate(index)
+
+    def release(self, index):
+        future, steps = self.building.pop(index, (None, None))
+
+        if steps is not None:
+            future.cancel()
+            steps.close()
+
+        chunk = self.chunks.pop(index, None)
+
+        if chunk is None:
+            return
+
+        first, last = chunk['columns']
+        self.tiles.release(first, last, chunk['colliders'])
+
+        for group, sprite in chunk['sprites']:
+            sprite.kill()
+            self.hashes[group].forget(sprite)
+
+            if group == 'enemies':
+                self.scheduler.remove(sprite)
+            else:
+                self.item_keys.pop(sprite, None)
+
+        self.invalidate(chunk)
+
+    def finish(self, index):
+        future, steps = self.building.pop(index)
+
+        for step in steps:
+            pass
+
+    def request(self, indices):
+        for index in indices:
+            if index not in self.chunks and index not in self.building:
+                future = self.executor.submit(self.read, index)
+                self.building[index] = (future, self.build(index, future))
+
+    def ensure(self, x):
+        # Finishes every chunk something within reach of x could touch; returns how many weren't ready
+        reach = 2 * WIDTH + 2 * GRID_SIZE
+        needed = self.chunk_range(x - reach, x + reach)
+        self.request(needed)
+        waited = 0
+
+        for index in needed:
+            if index in self.building:
+                self.finish(index)
+                waited += 1
+
+        return waited
+
+    def stream(self, hero):
+        x = hero.rect.x
+        size = self.chunk_cols * GRID_SIZE
+        reach = 2 * WIDTH + 2 * GRID_SIZE
+
+        # Remember what was collected, so it stays gone if its chunk comes back
+        for items in (self.coin_hash, self.powerup_hash):
+            for item in items.killed:
+                key = self.item_keys.pop(item, None)
+                items.forget(item)
+
+                if key is not None:
+                    self.taken.add(key)
+
+            items.killed = []
+
+        kept = self.chunk_range(x - max(stream_behind, reach + size), x + max(stream_ahead, reach) + size)
+
+        for index in [i for i in list(self.chunks) + list(self.building) if i not in kept]:
+            self.release(index)
+
+        self.stalls += self.ensure(x)
+        self.request(self.chunk_range(x - reach, x + max(stream_ahead, reach)))
+
+        # Spend what's left of the budget on the nearest chunks that have been read
+        deadline = time.perf_counter() + stream_budget_ms / 1000
+
+        for index in sorted(self.building, key=lambda i: abs(i * size - x)):
+            future, steps = self.building[index]
+
+            if not future.done():
+                continue
+
+            while time.perf_counter() < deadline:
+                if next(steps, False) is False:
+                    del self.building[index]
+                    break
+
+            if time.perf_counter() >= deadline:
+                break
+
+    def reset(self):
+        for index in list(self.chunks) + list(self.building):
+            self.release(index)
+
+        for items in (self.coin_hash, self.powerup_hash):
+            for item in items.killed:
+                items.forget(item)
+
+            items.killed = []
+
+        self.taken.clear()
+        self.ensure(self.start_x)
+
+    def restart(self):
+        self.time = self.time_limit
+        self.completed = False
+        self.reset()
+
+    def report(self):
+        return super().report() + "\nChunks: {} loaded, {} in progress, {} built, {} finished early".format(
+            len(self.chunks), len(self.building), self.loads, self.stalls)
+
+def open_level(path):
+    if os.path.isdir(path):
+        return StreamingLevel(path)
+
+    return Level(path)
+
+class Controls():
+
+    def __init__(self, left=False, right=False, jump=False, speed=None):
+        self.left = left
+        self.right = right
+        self.jump = jump
+        self.speed = speed
+
+class Engine():
+
+    # Game rules only: no window, audio or clock, so it can be stepped as fast as the CPU allows.
+    # Game passes its FrameProfiler in to time the phases of a step.
+    def __init__(self, level, hero=None, profiler=None):
+        if hero is None:
+            hero = Character(bunny_images, muted=True)
+
+        self.level = level
+        self.hero = hero
+        self.profiler = profiler
+        self.ticks = 0
+
+        # A level may have been played to the end already; start its clock over too
+        self.level.restart()
+        self.hero.respawn(self.level)
+
+    def failed(self):
+        return self.hero.lives == 0 or self.level.time == 0
+
+    def done(self):
+        return self.level.completed or self.failed()
+
+    def step(self, controls):
+        level = self.level
+        hero = self.hero
+        profiler = self.profiler
+
+        level.stream(hero)
+
+        if profiler is not None:
+            profiler.lap("stream")
+
+        if controls.jump:
+            hero.jump(level.tiles)
+
+        if controls.speed is not None:
+            hero.speed = controls.speed
+
+        if hero.jetpack_on == False:
+            if controls.left:
+                hero.move_left()
+            elif controls.right:
+                hero.move_right()
+            else:
+                hero.stop()
+
+        hero.update(level)
+
+        if profiler is not None:
+            profiler.lap("hero")
+
+        level.update_enemies(hero)
+
+        if profiler is not None:
+            profiler.lap("enemies")
+
+        level.calculate_time()
+
+        if hero.jetpack_on == True:
+            hero.calculate_jetpack_time()
+
+        if not self.done() and hero.hearts == 0:
+            level.reset()
+            hero.respawn(level)
+
+        self.ticks += 1
+
+    def snapshot(self):
+        self.check_snapshots()
+        snapshot = self.level.snapshot()
+        snapshot.hero = self.hero.state()
+        snapshot.ticks = self.ticks
+
+        return snapshot
+
+    def restore(self, snapshot):
+        self.check_snapshots()
+        self.level.restore(snapshot)
+        self.ticks = snapshot.ticks
+
+        if snapshot.hero is not None:
+            self.hero.set_state(snapshot.hero)
+
+    def check_snapshots(self):
+        # Snapshots number every entity up front, which a streamed level never has all of
+        if not isinstance(self.level, Level):
+            raise TypeError("can't snapshot a streamed level ({}); load it from a single file".format(self.level.path))
+
+    def run(self, ticks, controls):
+        # controls is either one Controls used every tick or a function returning one per tick
+        for i in range(ticks):
+            if self.done():
+                return i
+
+            if callable(controls):
+                self.step(controls(self))
+            else:
+                self.step(controls)
+
+        return ticks
+
+class TextCache():
+
+    def __init__(self, size):
+        self.size = size
+        self.surfaces = collections.OrderedDict()
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+        else:
+            surface = font.render(text, 1, color)
+            self.surfaces[key] = surface
+
+            if len(self.surfaces) > self.size:
+                self.surfaces.popitem(last=False)
+
+        return surface
+
+text_cache = TextCache(TEXT_CACHE_SIZE)
+
+class Hud():
+
+    # Draws the stats onto one transparent surface that's only redrawn when a value changes
+    def __init__(self):
+        self.values = None
+        self.surface = None
+        self.height = 0
+
+    def rebuild(self, hero, level, current_level):
+        hearts_text = text_cache.render(Bubblegum_Font, "Hearts: " + str(hero.hearts)+ "/" + str(hero.max_hearts), WHITE)
+        lives_text = text_cache.render(Bubblegum_Font, "x  " + str(hero.lives), WHITE)
+        score_text = text_cache.render(Bubblegum_Font, "Score: " + str(hero.score), WHITE)
+        level_text = text_cache.render(Bubblegum_Font, "Level: " + str(current_level + 1), WHITE)
+        coins_text = text_cache.render(Bubblegum_Font, "Coins: " + str(hero.coins), WHITE)
+        time_text = text_cache.render(Bubblegum_Font, "Time Remaining: " + str(level.time//60), WHITE)
+
+        items = [(score_text, (WIDTH - score_text.get_width() - 32, 32)),
+                 (hearts_text, (32, 32)),
+                 (bunny_images["idle"], (32, 64)),
+                 (lives_text, (128, 80)),
+                 (level_text, (32, 128)),
+                 (coins_text, (32, 160)),
+                 (time_text, (32, 192))]
+
+        if hero.jetpack_on == True:
+            jetpack_text = text_cache.render(Bubblegum_Font, "Jetpack Time: " + str(hero.jetpack_time//60), WHITE)
+            items.append((jetpack_text, (32, 224)))
+
+        self.height = max(pos[1] + img.get_height() for img, pos in items)
+
+        # Grows for the jetpack line and then stays; a shorter HUD just uses the top of it
+        if self.surface is None or self.surface.get_height() < self.height:
+            self.surface = pygame.Surface([WIDTH, self.height], pygame.SRCALPHA, 32)
+        else:
+            self.surface.fill(TRANSPARENT)
+
+        for img, pos in items:
+            self.surface.blit(img, pos)
+
+    def draw(self, surface, hero, level, current_level):
+        values = (hero.hearts, hero.max_hearts, hero.lives, hero.score, hero.coins, current_level,
+                  level.time//60, hero.jetpack_on, hero.jetpack_time//60)
+
+        if values != self.values:
+            self.values = values
+            self.rebuild(hero, level, current_level)
+
+        surface.blit(self.surface, [0, 0], [0, 0, WIDTH, self.height])
+
+class LevelPrefetcher():
+
+    # Builds upcoming levels on a worker thread so advancing doesn't stall a frame
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.pending = {}
+        self.timings = []
+
+    def build(self, index):
+        start = time.perf_counter()
+        level = open_level(levels[index])
+
+        return level, time.perf_counter() - start
+
+    def start(self, index):
+        if index < len(levels) and index not in self.pending:
+            self.pending[index] = self.executor.submit(self.build, index)
+
+    def take(self, index):
+        start = time.perf_counter()
+        future = self.pending.pop(index, None)
+
+        if future is not None:
+            level, build_time = future.result()
+            prefetched = True
+        else:
+            level, build_time = self.build(index)
+            prefetched = False
+
+        self.timings.append((index, prefetched, build_time, time.perf_counter() - start))
+
+        return level
+
+    def report(self):
+        lines = []
+
+        for index, prefetched, build_time, wait in self.timings:
+            lines.append("Level {}: {} in {:.1f} ms, swap waited {:.1f} ms".format(
+                index + 1, "prefetched" if prefetched else "loaded", build_time * 1000, wait * 1000))
+
+        return "\n".join(lines)
+
+class LevelWatcher():
+
+    # Checks the current level's file every watch_interval seconds and patches the
+    # running level when it changes, so edits show up without restarting the game
+    def __init__(self):
+        self.path = None
+        self.stamp = None
+        self.failed = None
+        self.last_check = 0
+
+    def check(self, game):
+        now = time.perf_counter()
+
+        if now - self.last_check < watch_interval:
+            return
+
+        self.last_check = now
+        path = game.level.path
+
+        stamp = file_stamp(path)
+
+        if stamp is None:
+            return
+
+        if path != self.path:
+            # A different level started. It may have been built a while ago by the
+            # prefetcher, so compare against the file it was built from, not the file now.
+            self.path = path
+            self.stamp = game.level.stamp
+            self.failed = None
+
+        if stamp == self.stamp or stamp == self.failed:
+            return
+
+        start = time.perf_counter()
+
+        try:
+            if os.path.isdir(path):
+                # A streamed level's directory only changes when a chunk file is replaced
+                summary = None
+            else:
+                with open(path, 'r') as f:
+                    map_data = json.loads(f.read())
+
+                summary = game.level.patch(map_data)
+
+            if summary is None:
+                game.reload_level()
+                summary = "loaded again"
+
+            game.shown = None
+        except (OSError, ValueError, KeyError, IndexError, pygame.error) as e:
+            # Most likely a half-saved file; the level is untouched and the next save tries again
+            print("Couldn't reload {}: {}".format(path, e))
+            self.failed = stamp
+            return
+
+        self.stamp = game.level.stamp = stamp
+        print("Reloaded {} in {:.1f} ms: {}".format(path, (time.perf_counter() - start) * 1000, summary))
+
+class FrameProfiler():
+
+    PHASES = ["events", "stream", "hero", "enemies", "update", "layers", "tiles", "sprites", "hud", "overlay", "flip", "wait"]
+    GRAPH_FRAMES = 240
+    GRAPH_HEIGHT = 96
+
+    # One ring buffer of seconds per phase; lap() is a single attribute check while disabled
+    def __init__(self, size):
+        self.size = size
+        self.columns = {phase: i for i, phase in enumerate(FrameProfiler.PHASES)}
+        self.samples = [array.array('d', bytes(8 * size)) for phase in FrameProfiler.PHASES]
+        self.row = [0.0] * len(FrameProfiler.PHASES)
+        self.count = 0
+        self.enabled = False
+        self.active = False
+        self.last = 0
+        self.text = None
+        self.path = None
+
+    def begin(self):
+        self.active = self.enabled
+
+        if self.active:
+            self.row = [0.0] * len(FrameProfiler.PHASES)
+            self.last = time.perf_counter()
+
+    def lap(self, phase):
+        if self.active:
+            now = time.perf_counter()
+            self.row[self.columns[phase]] += now - self.last
+            self.last = now
+
+    def end(self):
+        if self.active:
+            slot = self.count % self.size
+
+            for samples, value in zip(self.samples, self.row):
+                samples[slot] = value
+
+            self.count += 1
+            self.active = False
+
+    def frames(self):
+        # Slots of the recorded frames, oldest first
+        n = min(self.count, self.size)
+        return [(self.count - n + i) % self.size for i in range(n)]
+
+    def work(self, slot):
+        return sum(samples[slot] for samples in self.samples) - self.samples[self.columns["wait"]][slot]
+
+    def percentiles(self, phase, points=(50, 95, 99)):
+        if phase == "work":
+            values = sorted(self.work(slot) for slot in self.frames())
+        else:
+            samples = self.samples[self.columns[phase]]
+            values = sorted(samples[slot] for slot in self.frames())
+
+        if len(values) == 0:
+            return [0.0 for p in points]
+
+        return [values[(len(values) - 1) * p // 100] for p in points]
+
+    def records(self):
+        first = self.count - min(self.count, self.size)
+        records = []
+
+        for i, slot in enumerate(self.frames()):
+            record = {"frame": first + i}
+
+            for phase, samples in zip(FrameProfiler.PHASES, self.samples):
+                record[phase] = round(samples[slot] * 1000, 4)
+
+            records.append(record)
+
+        return records
+
+    def export(self, path):
+        records = self.records()
+
+        with open(path, 'w', newline='') as f:
+            if path.endswith(".csv"):
+                writer = csv.DictWriter(f, ["frame"] + FrameProfiler.PHASES)
+                writer.writeheader()
+                writer.writerows(records)
+            else:
+                json.dump(records, f, indent=1)
+
+    def render_text(self):
+        rows = [["phase (ms)", "p50", "p95", "p99"]]
+
+        for phase in ["work"] + FrameProfiler.PHASES:
+            rows.append([phase] + ["{:.2f}".format(value * 1000) for value in self.percentiles(phase)])
+
+        self.text = [[Debug_Font.render(cell, 1, WHITE) for cell in row] for row in rows]
+
+    def draw(self, surface):
+        if self.text is None or self.count % 30 == 0:
+            self.render_text()
+
+        line_height = Debug_Font.get_linesize()
+        width = 2 * FrameProfiler.GRAPH_FRAMES
+        height = FrameProfiler.GRAPH_HEIGHT + 8 + line_height * len(self.text)
+        x = WIDTH - width - 16
+        y = HEIGHT - height - 16
+
+        panel = pygame.Surface([width, height], pygame.SRCALPHA, 32)
+        panel.fill((0, 0, 0, 160))
+
+        # 16.7 ms budget is the middle of the graph
+        scale = FrameProfiler.GRAPH_HEIGHT * FPS / 2
+        slots = self.frames()[-FrameProfiler.GRAPH_FRAMES:]
+
+        for i, slot in enumerate(slots):
+            bar = min(int(self.work(slot) * scale), FrameProfiler.GRAPH_HEIGHT)
+            pygame.draw.line(panel, (120, 255, 120), [2 * i, FrameProfiler.GRAPH_HEIGHT], [2 * i, FrameProfiler.GRAPH_HEIGHT - bar], 2)
+
+        pygame.draw.line(panel, (255, 80, 80), [0, FrameProfiler.GRAPH_HEIGHT // 2], [width, FrameProfiler.GRAPH_HEIGHT // 2])
+
+        for i, row in enumerate(self.text):
+            y_row = FrameProfiler.GRAPH_HEIGHT + 8 + i * line_height
+            panel.blit(row[0], [4, y_row])
+
+            # right-align the numbers in 64 px columns
+            for j, cell in enumerate(row[1:]):
+                panel.blit(cell, [96 + 64 * (j + 1) - cell.get_width(), y_row])
+
+        surface.blit(panel, [x, y])
+
+        return pygame.Rect(x, y, width, height)
+
+profiler = FrameProfiler(profile_frames)
+
+class Recorder():
+
+    # Stores the Controls of every PLAYING frame as runs of identical input,
+    # plus a checkpoint of score, lives and position once a second
+    def __init__(self):
+        self.runs = []
+        self.checkpoints = []
+        self.frames = 0
+        self.finished = False
+
+    def record(self, game):
+        controls = game.controls
+        bits = controls.left | controls.right << 1 | controls.jump << 2
+        speed = 0 if controls.speed is None else controls.speed
+
+        if len(self.runs) > 0 and self.runs[-1][1:] == [bits, speed] and self.runs[-1][0] < 0xFFFF:
+            self.runs[-1][0] += 1
+        else:
+            self.runs.append([1, bits, speed])
+
+        self.frames += 1
+
+        if self.frames % REPLAY_CHECKPOINT == 0:
+            self.checkpoints.append([self.frames] + game.checkpoint())
+
+    def finish(self, game):
+        if not self.finished:
+            self.checkpoints.append([self.frames] + game.checkpoint())
+            self.finished = True
+
+    def save(self, path):
+        header = json.dumps({"version": REPLAY_VERSION, "frames": self.frames,
+                             "checkpoints": self.checkpoints}).encode()
+
+        with open(path, 'wb') as f:
+            f.write(REPLAY_MAGIC + struct.pack('<I', len(header)) + header)
+
+            for run in self.runs:
+                f.write(struct.pack('<HBB', *run))
+
+class ReplayPlayer():
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        if data[:4] != REPLAY_MAGIC:
+            raise ValueError("not a replay: " + path)
+
+        header_len = struct.unpack_from('<I', data, 4)[0]
+        header = json.loads(data[8:8 + header_len])
+
+        if header['version'] != REPLAY_VERSION:
+            raise ValueError("unsupported replay version: " + str(header['version']))
+
+        self.frames = header['frames']
+        self.checkpoints = {c[0]: c[1:] for c in header['checkpoints']}
+        self.runs = list(struct.iter_unpack('<HBB', data[8 + header_len:]))
+        self.desyncs = []
+
+    def controls(self):
+        for count, bits, speed in self.runs:
+            for i in range(count):
+                yield Controls(bool(bits & 1), bool(bits & 2), bool(bits & 4), speed or None)
+
+    def play(self, game, speed=0):
+        # speed is a multiple of FPS; 0 runs as fast as the CPU allows without drawing
+        game.hero.muted = speed == 0
+        frame = 0
+
+        for controls in self.controls():
+            profiler.begin()
+
+            if game.stage == Game.SPLASH or game.stage == Game.START:
+                game.stage = Game.PLAYING
+            elif game.stage == Game.LEVEL_COMPLETED:
+                game.advance()
+                game.stage = Game.PLAYING
+            elif game.stage != Game.PLAYING:
+                break
+
+            game.controls = controls
+            game.update()
+            frame += 1
+
+            expected = self.checkpoints.get(frame)
+
+            if expected is not None and expected != game.checkpoint():
+                self.desyncs.append([frame, expected, game.checkpoint()])
+
+            if speed > 0:
+                pygame.event.pump()
+                game.draw()
+                game.clock.tick(FPS * speed)
+                profiler.lap("wait")
+
+            profiler.end()
+
+        return frame
+
+class Game():
+
+    SPLASH = 0
+    START = 1
+    PLAYING = 2
+    PAUSED = 3
+    LEVEL_COMPLETED = 4
+    GAME_OVER = 5
+    VICTORY = 6
+
+    def __init__(self):
+        self.window = pygame.display.set_mode([WIDTH, HEIGHT])
+        pygame.display.set_caption(TITLE)
+        atlas.convert()
+        frame_cache.refresh()
+        self.clock = pygame.time.Clock()
+        self.done = False
+        self.level = None
+        self.level_index = None
+        self.watcher = None
+        self.controls = Controls()
+        self.hud = Hud()
+        self.prefetcher = LevelPrefetcher()
+        self.recorder = None
+        self.show_profiler = False
+        self.previous = {}
+        self.shown = None
+        self.still = None
+        self.overlay_area = None
+
+        self.reset()
+
+    def start(self):
+        if debug and self.level is not None:
+            print(self.level.report())
+
+        # Playing the same level again just restores its starting snapshot
+        if self.level is None or self.level_index != self.current_level:
+            self.level = self.prefetcher.take(self.current_level)
+            self.level_index = self.current_level
+
+        self.engine = Engine(self.level, self.hero, profiler)
+        audio.load_music(self.level.music)
+
+        self.prefetcher.start(self.current_level + 1)
+
+    def reload_level(self):
+        # Loads the current level from disk again, leaving the hero where it was
+        position = self.hero.rect.topleft
+        self.level = open_level(self.level.path)
+        self.engine = Engine(self.level, self.hero, profiler)
+        self.hero.rect.topleft = position
+
+    def advance(self):
+        self.current_level += 1
+        self.start()
+        self.stage = Game.START
+        self.hero.score += (self.level.time * 5)
+
+    def reset(self):
+        self.hero = Character(bunny_images)
+        self.current_level = 0
+        self.start()
+        self.stage = Game.SPLASH
+
+    def display_splash(self, surface):
+        line1 = text_cache.render(Chocolate_Bar_Font, TITLE, DARK_BLUE)
+        line2 = text_cache.render(Chocolate_Bar_Font, "Are you up to the challenge?", WHITE)
+        line3 = text_cache.render(Chocolate_Bar_Font, "PRESS ANY KEY TO START", WHITE)
+
+        x1 = WIDTH / 2 - line1.get_width() / 2;
+        y1 = HEIGHT / 3 - line1.get_height() / 2;
+
+        x2 = WIDTH / 2 - line2.get_width() / 2;
+        y2 = y1 + line1.get_height() + 16;
+
+        x3 = WIDTH / 2 - line3.get_width() / 2;
+        y3 = HEIGHT - line3.get_height() - 64;
+
+        bun_x1 = 64
+        bun_y1 = 64
+        bun_x2 = WIDTH - 128
+        bun_y2 = HEIGHT - 128
+
+        pygame.draw.rect(surface, PURPLE, [0, 0, WIDTH, HEIGHT])
+        surface.blit(line1, (x1, y1))
+        surface.blit(line2, (x2, y2))
+        surface.blit(line3, (x3, y3))
+        surface.blit(bunny_images["idle"], (bun_x1, bun_y1))
+        surface.blit(bunny_images["idle"], (bun_x1, bun_y2))
+        surface.blit(bunny_images["idle"], (bun_x2, bun_y1))
+        surface.blit(bunny_images["idle"], (bun_x2, bun_y2))
+
+    def display_message(self, surface, primary_text, secondary_text):
+        line1 = text_cache.render(Chocolate_Bar_Font, primary_text, WHITE)
+        line2 = text_cache.render(Chocolate_Bar_Font, secondary_text, WHITE)
+
+        x1 = WIDTH / 2 - line1.get_width() / 2;
+        y1 = HEIGHT / 3 - line1.get_height() / 2;
+
+        x2 = WIDTH / 2 - line2.get_width() / 2;
+        y2 = y1 + line1.get_height() + 16;
+
+        box_x = WIDTH / 2 - line2.get_width() / 2;
+        box_y = HEIGHT / 3 - line1.get_height() / 2;
+        box_w = line2.get_width()
+        box_h = line1.get_height() + line2.get_height() + 16;
+
+        pygame.draw.rect(surface, PURPLE, [box_x, box_y, box_w, box_h])
+        surface.blit(line1, (x1, y1))
+        surface.blit(line2, (x2, y2))
+
+    def display_stats(self, surface):
+        self.hud.draw(surface, self.hero, self.level, self.current_level)
+
+    def display_credits(self, surface):
+        line1 = text_cache.render(Chocolate_Bar_Font, "CONGRATULATIONS!", WHITE)
+        line2 = text_cache.render(Chocolate_Bar_Font, "You are the ultImate bunny runner", WHITE)
+        line3 = text_cache.render(Chocolate_Bar_Font, "Score: " + str(self.hero.score), WHITE)
+        line4 = text_cache.render(Chocolate_Bar_Font, "Press R to Run AgaIn", WHITE)
+        line5 = text_cache.render(Bubblegum_Font, "Bunny Run created by: Casey Groves", WHITE)
+
+        x1 = WIDTH / 2 - line1.get_width() / 2;
+        y1 = HEIGHT / 5;
+
+        x2 = WIDTH / 2 - line2.get_width() / 2;
+        y2 = y1 + line2.get_height() + 16;
+
+        x3 = WIDTH / 2 - line3.get_width() / 2;
+        y3 = y2 + line3.get_height() + 16;
+
+        x4 = WIDTH / 2 - line4.get_width() / 2;
+        y4 = y3 + line4.get_height() + 16;
+
+        x5 = WIDTH / 2 - line5.get_width() / 2;
+        y5 = y4 + line5.get_height() + 64;
+
+        pygame.draw.rect(surface, PURPLE, [0, 0, WIDTH, HEIGHT])
+        surface.blit(line1, (x1, y1))
+        surface.blit(line2, (x2, y2))
+        surface.blit(line3, (x3, y3))
+        surface.blit(line4, (x4, y4))
+        surface.blit(line5, (x5, y5))
+
+    def process_events(self):
+        self.controls = Controls()
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.done = True
+
+            elif event.type == pygame.VIDEOEXPOSE:
+                self.shown = None
+
+            elif event.type == pygame.KEYDOWN and event.key == PROFILE_KEY:
+                self.show_profiler = not self.show_profiler
+                profiler.enabled = self.show_profiler or profiler.path is not None
+
+            elif event.type == pygame.KEYDOWN:
+                if self.stage == Game.SPLASH or self.stage == Game.START:
+                    self.stage = Game.PLAYING
+                    audio.play_music()
+
+                elif self.stage == Game.PLAYING:
+                    if event.key == JUMP:
+                        self.controls.jump = True
+                    if event.key == pygame.K_f:
+                        self.controls.speed = 10
+                    elif event.key != pygame.K_f:
+                        self.controls.speed = 5
+
+                elif self.stage == Game.PAUSED:
+                    pass
+
+                elif self.stage == Game.LEVEL_COMPLETED:
+                    self.advance()
+
+                elif self.stage == Game.VICTORY or self.stage == Game.GAME_OVER:
+                    if event.key == pygame.K_r:
+                        self.reset()
+
+        pressed = pygame.key.get_pressed()
+
+        if self.stage == Game.PLAYING:
+            self.controls.left = pressed[LEFT]
+            self.controls.right = pressed[RIGHT]
+
+    def update(self):
+        if self.stage == Game.PLAYING:
+            self.engine.step(self.controls)
+
+            if self.recorder is not None and not self.recorder.finished:
+                self.recorder.record(self)
+
+        if self.level.completed:
+            if self.current_level < len(levels) - 1:
+                self.stage = Game.LEVEL_COMPLETED
+            else:
+                self.stage = Game.VICTORY
+            audio.stop_music()
+
+        elif self.engine.failed():
+            self.stage = Game.GAME_OVER
+            audio.stop_music()
+
+        if self.recorder is not None and (self.stage == Game.VICTORY or self.stage == Game.GAME_OVER):
+            self.recorder.finish(self)
+
+        profiler.lap("update")
+
+    def checkpoint(self):
+        return [self.current_level, self.hero.score, self.hero.lives, self.hero.rect.x, self.hero.rect.y]
+
+    def calculate_offset(self, centerx=None):
+        if centerx is None:
+            centerx = self.hero.rect.centerx
+
+        x = -1 * centerx + WIDTH / 2
+
+        if centerx < WIDTH / 2:
+            x = 0
+        elif centerx > self.level.width - WIDTH / 2:
+            x = -1 * self.level.width + WIDTH
+
+        return x, 0
+
+    def remember_positions(self):
+        # Where the hero and every enemy that could be on screen stand before a step
+        offset_x, offset_y = self.calculate_offset()
+        area = pygame.Rect(-int(offset_x), -int(offset_y), WIDTH, HEIGHT).inflate(4 * GRID_SIZE, 4 * GRID_SIZE)
+
+        self.previous = {e: e.rect.topleft for e in self.level.enemy_hash.query(area)}
+        self.previous[self.hero] = self.hero.rect.topleft
+
+    def position(self, sprite, alpha):
+        # alpha of the way from the last position to the current one; respawns and
+        # teleports snap instead of sliding across the screen
+        x, y = sprite.rect.topleft
+        previous = self.previous.get(sprite)
+
+        if alpha is None or previous is None:
+            return x, y
+        if abs(x - previous[0]) > 2 * GRID_SIZE or abs(y - previous[1]) > 2 * GRID_SIZE:
+            return x, y
+
+        return round(previous[0] + (x - previous[0]) * alpha), round(previous[1] + (y - previous[1]) * alpha)
+
+    def scene(self):
+        # Everything a static screen shows; while it's unchanged the display already has it
+        hero = self.hero
+
+        return (self.stage, self.level, self.current_level, tuple(hero.rect), hero.image, hero.invincibility,
+                hero.score, hero.lives, hero.hearts, hero.coins, self.level.time, self.show_profiler)
+
+    def idle(self):
+        # Nothing on a static screen moves without input, unless the profiler graph is up
+        return throttle_idle and self.stage != Game.PLAYING and not self.show_profiler
+
+    def wait_for_input(self):
+        # Sleeps until an event arrives, leaving it queued for process_events
+        event = pygame.event.wait(idle_timeout_ms)
+
+        if event.type != pygame.NOEVENT:
+            pygame.event.post(event)
+
+    def draw_overlay(self):
+        # Only the profiler graph can change on a static screen that's already shown,
+        # so put back what was under it and push just that rect
+        if self.show_profiler:
+            area = self.overlay_area
+            self.window.blit(self.still, area, area)
+            profiler.draw(self.window)
+            profiler.lap("overlay")
+            pygame.display.update(area)
+            profiler.lap("flip")
+
+    def draw(self, alpha=None):
+        scene = None
+
+        if throttle_idle and self.stage != Game.PLAYING:
+            scene = self.scene()
+
+            if scene == self.shown:
+                self.draw_overlay()
+                return
+
+        hero_x, hero_y = self.position(self.hero, alpha)
+        offset_x, offset_y = self.calculate_offset(hero_x + self.hero.rect.width // 2)
+        offset_x, offset_y = int(offset_x), int(offset_y)
+        viewport = pygame.Rect(-offset_x, -offset_y, WIDTH, HEIGHT)
+
+        self.level.background_layer.draw(self.window, offset_x / 3, offset_y)
+        self.level.scenery_layer.draw(self.window, offset_x / 2, offset_y)
+        profiler.lap("layers")
+
+        self.level.tile_cache.draw(self.window, offset_x, offset_y)
+        profiler.lap("tiles")
+
+        for sprite in self.level.visible_sprites(viewport):
+            x, y = self.position(sprite, alpha)
+            self.window.blit(sprite.image, [x + offset_x, y + offset_y])
+
+        if self.hero.invincibility % 3 < 2:
+            self.window.blit(self.hero.image, [hero_x + offset_x, hero_y + offset_y])
+
+        profiler.lap("sprites")
+
+        self.display_stats(self.window)
+
+        if self.stage == Game.SPLASH:
+            self.display_splash(self.window)
+        elif self.stage == Game.START:
+            self.display_message(self.window, "Ready?!!!", "Press any key to start")
+        elif self.stage == Game.PAUSED:
+            pass
+        elif self.stage == Game.LEVEL_COMPLETED:
+            self.display_message(self.window, "Level Complete", "Press any key to continue")
+        elif self.stage == Game.VICTORY:
+            self.display_credits(self.window)
+        elif self.stage == Game.GAME_OVER:
+            self.display_message(self.window, "Game Over", "Press 'R' to restart")
+
+        profiler.lap("hud")
+
+        self.shown = scene
+
+        if self.show_profiler:
+            if scene is not None:
+                self.still = self.window.copy()
+
+            self.overlay_area = profiler.draw(self.window)
+            profiler.lap("overlay")
+
+        pygame.display.flip()
+        profiler.lap("flip")
+
+    def loop(self):
+        if fixed_timestep:
+            self.loop_fixed()
+            return
+
+        while not self.done:
+            profiler.begin()
+            self.process_events()
+
+            if self.watcher is not None:
+                self.watcher.check(self)
+
+            profiler.lap("events")
+            self.update()
+            self.draw()
+
+            if self.idle():
+                self.wait_for_input()
+            else:
+                self.clock.tick(FPS)
+
+            profiler.lap("wait")
+            profiler.end()
+
+    def loop_fixed(self):
+        # The game steps FPS times per second of real time however long drawing takes,
+        # catching up at most max_catch_up steps per frame. Frames are drawn part way
+        # between the last two steps so motion stays smooth at any render rate.
+        step = 1 / FPS
+        lag = 0
+        last = time.perf_counter()
+        pending = Controls()
+
+        while not self.done:
+            profiler.begin()
+            now = time.perf_counter()
+            lag += now - last
+            last = now
+
+            self.process_events()
+
+            if self.watcher is not None:
+                self.watcher.check(self)
+
+            profiler.lap("events")
+
+            # A jump or speed key pressed on a frame with no step waits for the next one
+            pending = Controls(self.controls.left, self.controls.right,
+                               pending.jump or self.controls.jump,
+                               self.controls.speed if self.controls.speed is not None else pending.speed)
+            steps = 0
+
+            while lag >= step and steps < max_catch_up:
+                self.controls = pending
+                self.remember_positions()
+                self.update()
+                pending = Controls(pending.left, pending.right)
+                lag -= step
+                steps += 1
+
+            if lag >= step:
+                # Too far behind to catch up; let the game slow down instead of spiralling
+                lag = 0
+
+            self.draw(lag / step)
+
+            if self.idle():
+                self.wait_for_input()
+
+                # Time spent waiting on a static screen isn't owed to the simulation
+                last = time.perf_counter()
+                lag = 0
+            else:
+                self.clock.tick(render_fps)
+
+            profiler.lap("wait")
+            profiler.end()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=TITLE)
+    parser.add_argument("--record", metavar="FILE", help="record your inputs to FILE")
+    parser.add_argument("--replay", metavar="FILE", help="play back a recording made with --record")
+    parser.add_argument("--speed", type=float, default=0, help="replay speed as a multiple of normal, 0 for as fast as possible")
+    parser.add_argument("--profile", metavar="FILE", help="time every frame and write the last {} to FILE (.csv or .json)".format(profile_frames))
+    parser.add_argument("--watch", action="store_true", help="reload the current level whenever its file is saved")
+    parser.add_argument("--level", metavar="PATH", help="play only this level, a JSON file or a directory from make_level.py --stream")
+    args = parser.parse_args()
+
+    if args.level:
+        levels[:] = [args.level]
+
+    game = Game()
+    profiler.path = args.profile
+    profiler.enabled = profiler.path is not None
+
+    if args.replay:
+        player = ReplayPlayer(args.replay)
+        start = time.perf_counter()
+        frames = player.play(game, args.speed)
+        elapsed = time.perf_counter() - start
+
+        print("Replayed {} of {} frames in {:.2f} s ({:.0f} frames/s)".format(
+            frames, player.frames, elapsed, frames / max(elapsed, 1e-9)))
+
+        for frame, expected, actual in player.desyncs:
+            print("Desync at frame {}: expected {}, got {}".format(frame, expected, actual))
+    else:
+        if args.record:
+            game.recorder = Recorder()
+
+        if args.watch:
+            game.watcher = LevelWatcher()
+
+        game.start()
+        game.loop()
+
+        if args.record:
+            game.recorder.finish(game)
+            game.recorder.save(args.record)
+
+    if profiler.path is not None:
+        profiler.export(profiler.path)
+
+    if debug:
+        print(game.level.report())
+        print(game.prefetcher.report())
     pygame.quit()
-    sys.exit()
+    sys.exit(1 if args.replay and player.desyncs else 0)
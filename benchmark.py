@@ -0,0 +1,268 @@
+# Benchmarks for Bunny Run's load, simulate and render paths.
+#
+#   python benchmark.py                            run everything, write benchmark.json
+#   python benchmark.py --out base.json            save a baseline
+#   python benchmark.py --baseline base.json       run and flag regressions against it
+#   python benchmark.py --compare base.json new.json
+#
+# Each level runs in its own process under SDL's dummy drivers, so a level that
+# runs out of memory is reported as an error instead of ending the run.
+
+import os
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+import argparse
+import importlib.util
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+GAME_FILE = os.path.join(ROOT, "Casey's Bunny Run.py")
+SCALED_DIR = "cache/bench"
+
+LEVELS = ["levels/world-1.json",
+          "levels/world-2.json",
+          "levels/world-3.json",
+          "levels/world-4.json"]
+
+SCALES = [1, 10, 100]
+ENTITY_KINDS = ['bears', 'monsters', 'flyman', 'coins', 'oneups', 'hearts',
+                'powerup', 'bolt', 'jetpack', 'bubble']
+ENEMY_KINDS = ['bears', 'monsters', 'flyman']
+
+# Lower is better for every metric
+METRICS = ["load_first_ms", "load_ms", "tick_us", "tick_p95_us", "draw_ms", "draw_p95_ms"]
+
+def load_game():
+    spec = importlib.util.spec_from_file_location("bunny_run", GAME_FILE)
+    game = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(game)
+
+    return game
+
+def scale_level(path, factor):
+    # factor times wider by repeating the map, with factor // 10 + 1 enemies on every enemy spot
+    with open(path) as f:
+        map_data = json.load(f)
+
+    width = map_data['width']
+    density = factor // 10 + 1
+    scaled = dict(map_data)
+    scaled['name'] = "{} x{}".format(map_data['name'], factor)
+    scaled['width'] = width * factor
+    scaled['time'] = map_data['time'] * factor
+    scaled['blocks'] = [[x + i * width, y, kind] for i in range(factor) for x, y, kind in map_data['blocks']]
+
+    for kind in ENTITY_KINDS:
+        copies = density if kind in ENEMY_KINDS else 1
+        scaled[kind] = [[x + i * width, y] for i in range(factor) for x, y in map_data[kind] for c in range(copies)]
+
+    scaled['flag'] = [[x + (factor - 1) * width, y] for x, y in map_data['flag']]
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    out_path = os.path.join(SCALED_DIR, "{}-x{}.json".format(name, factor))
+    text = json.dumps(scaled)
+
+    # Only rewrite on change so the compiled level cache stays valid between runs
+    if not os.path.exists(out_path) or open(out_path).read() != text:
+        os.makedirs(SCALED_DIR, exist_ok=True)
+
+        with open(out_path, 'w') as f:
+            f.write(text)
+
+    return out_path
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[(len(values) - 1) * p // 100]
+
+def scripted_controls(game):
+    # Run right, jumping every half second, like a player pushing through the level
+    def controls(engine):
+        return game.Controls(right=True, jump=engine.ticks % 30 == 0)
+
+    return controls
+
+def bench_level(path, ticks, repeat):
+    game = load_game()
+    result = {"level": path}
+
+    # Sprites keep the atlas surfaces they're built with, so convert it for the display
+    # first, the way Game does, or draw_ms ends up timing unconverted blits
+    game.pygame.display.set_mode([game.WIDTH, game.HEIGHT])
+    game.atlas.convert()
+    game.frame_cache.refresh()
+
+    start = time.perf_counter()
+    game.Level(path)
+    result["load_first_ms"] = (time.perf_counter() - start) * 1000
+
+    loads = []
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        level = game.Level(path)
+        loads.append((time.perf_counter() - start) * 1000)
+
+    result["load_ms"] = statistics.median(loads)
+
+    # Simulation: hero and enemy updates only, restarting the level whenever it ends
+    controls = scripted_controls(game)
+    engine = game.Engine(level)
+    engine.run(game.FPS, controls)
+    samples = []
+
+    while len(samples) < ticks:
+        if engine.done():
+            engine = game.Engine(level)
+
+        start = time.perf_counter()
+        engine.step(controls(engine))
+        samples.append((time.perf_counter() - start) * 1e6)
+
+    result["tick_us"] = statistics.median(samples)
+    result["tick_p95_us"] = percentile(samples, 95)
+    result["enemies"] = len(level.enemies)
+
+    # Rendering: a Game drawing the level while the engine plays it
+    window = game.Game()
+    window.level = level
+    window.engine = engine = game.Engine(level)
+    window.hero = engine.hero
+    window.stage = game.Game.PLAYING
+    samples = []
+
+    while len(samples) < ticks // 2:
+        if engine.done():
+            window.engine = engine = game.Engine(level)
+            window.hero = engine.hero
+
+        engine.step(controls(engine))
+
+        start = time.perf_counter()
+        window.draw()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    result["draw_ms"] = statistics.median(samples[game.FPS // 2:])
+    result["draw_p95_ms"] = percentile(samples[game.FPS // 2:], 95)
+
+    return result
+
+def run_case(path, ticks, repeat):
+    # A fresh interpreter per level keeps loads cold and memory failures contained
+    command = [sys.executable, __file__, "--worker", path, "--ticks", str(ticks), "--repeat", str(repeat)]
+    proc = subprocess.run(command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    lines = proc.stdout.strip().splitlines()
+
+    if proc.returncode != 0 or len(lines) == 0:
+        error = proc.stderr.strip().splitlines()
+        return {"level": path, "error": error[-1] if error else "exit code {}".format(proc.returncode)}
+
+    return json.loads(lines[-1])
+
+def environment():
+    import pygame
+
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+
+    return {"python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "numpy": numpy_version,
+            "machine": platform.machine(),
+            "system": platform.system(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+def run(args):
+    results = {}
+
+    for path in args.levels:
+        for factor in args.scales:
+            name = os.path.splitext(os.path.basename(path))[0]
+            key = name if factor == 1 else "{}-x{}".format(name, factor)
+            case = path if factor == 1 else scale_level(path, factor)
+
+            print("{:<16}".format(key), end=" ", flush=True)
+            result = run_case(case, args.ticks, args.repeat)
+            results[key] = result
+
+            if "error" in result:
+                print("error: " + result["error"])
+            else:
+                print("load {:8.2f} ms   tick {:8.1f} us   draw {:6.2f} ms   ({} enemies)".format(
+                    result["load_ms"], result["tick_us"], result["draw_ms"], result["enemies"]))
+
+    return {"environment": environment(), "ticks": args.ticks, "results": results}
+
+def compare(baseline, current, threshold):
+    regressions = []
+
+    for key, result in current["results"].items():
+        base = baseline["results"].get(key)
+
+        if base is None or "error" in base or "error" in result:
+            continue
+
+        for metric in METRICS:
+            if metric in base and metric in result and base[metric] > 0:
+                change = result[metric] / base[metric] - 1
+                flag = "REGRESSION" if change > threshold else ""
+                print("{:<16} {:<14} {:10.2f} -> {:10.2f}  {:+7.1%} {}".format(
+                    key, metric, base[metric], result[metric], change, flag))
+
+                if change > threshold:
+                    regressions.append((key, metric, change))
+
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bunny Run benchmarks")
+    parser.add_argument("--levels", nargs="+", default=LEVELS, help="level files to benchmark")
+    parser.add_argument("--scales", nargs="+", type=int, default=SCALES, help="width multiples to generate from each level")
+    parser.add_argument("--ticks", type=int, default=600, help="ticks to time per level")
+    parser.add_argument("--repeat", type=int, default=5, help="times to reload each level")
+    parser.add_argument("--out", default="benchmark.json", help="where to write the results")
+    parser.add_argument("--baseline", help="flag regressions against this earlier result")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="compare two result files without running")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown that counts as a regression")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+
+    if args.worker:
+        print(json.dumps(bench_level(args.worker, args.ticks, args.repeat)))
+        sys.exit()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+    else:
+        current = run(args)
+
+        with open(args.out, 'w') as f:
+            json.dump(current, f, indent=2)
+
+        print("Wrote " + args.out)
+
+        baseline = None
+
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+
+    if baseline is not None:
+        regressions = compare(baseline, current, args.threshold)
+        print("{} regression(s) over {:.0%}".format(len(regressions), args.threshold))
+        sys.exit(1 if regressions else 0)
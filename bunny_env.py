@@ -0,0 +1,332 @@
+# Many windowless Bunny Run games stepped together, for agents and difficulty checks.
+#
+#   env = BunnyBatch(["levels/world-1.json"], 256)
+#   obs = env.reset()
+#   obs, rewards, dones, info = env.step(actions)
+#
+# An action is LEFT, RIGHT, JUMP and FAST added together, one int per game.
+# Observations are NumPy arrays stacked over the batch:
+#   tiles    uint8   (n, VIEW_ROWS, VIEW_COLS)  solid cells around the hero, walls at the level's sides
+#   hero     float32 (n, len(HERO_FEATURES))
+#   enemies  float32 (n, NEAREST_ENEMIES, 5)     dx, dy, vx, vy, present; nearest first
+# Rewards are score gained. Finished games restart on their own and report it in dones.
+#
+# ProcessBatch has the same interface and splits the games over worker processes.
+# Both change into the game's directory, since levels and assets use relative paths.
+
+import os
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+import importlib.util
+import multiprocessing
+import time
+
+import numpy
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+GAME_FILE = os.path.join(ROOT, "Casey's Bunny Run.py")
+
+LEFT = 1
+RIGHT = 2
+JUMP = 4
+FAST = 8
+ACTIONS = 16
+
+VIEW_COLS = 15
+VIEW_ROWS = 10
+NEAREST_ENEMIES = 8
+FRAME_SKIP = 4
+ALERT_DISTANCE = 3 * 64
+
+HERO_FEATURES = ["x", "y", "vx", "vy", "on_ground", "hearts", "lives", "score",
+                 "coins", "invincibility", "jetpack", "time"]
+
+game = None
+
+def load_game():
+    # One copy of the game module per process
+    global game
+
+    if game is None:
+        os.chdir(ROOT)
+        spec = importlib.util.spec_from_file_location("bunny_run", GAME_FILE)
+        game = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(game)
+
+    return game
+
+class LevelData():
+
+    # The parsed level (entity tables and TileMap) shared by every game playing it in
+    # this process; each game still builds its own sprites and parallax layers
+    def __init__(self, path, view):
+        self.path = path
+        self.map_data = game.load_map(path)
+
+        if 'tiles' not in self.map_data:
+            self.map_data['tiles'] = game.TileMap(self.map_data['blocks'], self.map_data['width'],
+                                                  self.map_data['height'])
+
+        self.tiles = self.map_data['tiles']
+        self.view = view
+
+        cols, rows = self.tiles.cols, self.tiles.rows
+        pad_cols, pad_rows = view[0] // 2, view[1] // 2
+        solid = numpy.frombuffer(b"".join(self.tiles.columns), dtype=numpy.uint8).reshape(cols, rows) != 0
+
+        self.solid = numpy.zeros((cols + 2 * pad_cols, rows + 2 * pad_rows), dtype=numpy.uint8)
+        self.solid[:pad_cols] = 1
+        self.solid[pad_cols + cols:] = 1
+        self.solid[:, :pad_rows] = 0
+        self.solid[:, pad_rows + rows:] = 0
+        self.solid[pad_cols:pad_cols + cols, pad_rows:pad_rows + rows] = solid
+
+        self.col_offsets = numpy.arange(view[0])
+        self.row_offsets = numpy.arange(view[1])
+
+    def instance(self):
+        return game.Level(self.path, self.map_data)
+
+    def windows(self, cols, rows):
+        # Because of the padding, the window centred on (col, row) starts at (col, row)
+        cols = numpy.clip(cols, 0, self.tiles.cols - 1)
+        rows = numpy.clip(rows, 0, self.tiles.rows - 1)
+        grid = self.solid[cols[:, None, None] + self.col_offsets[None, :, None],
+                          rows[:, None, None] + self.row_offsets[None, None, :]]
+
+        return grid.transpose(0, 2, 1)
+
+class BunnyBatch():
+
+    def __init__(self, levels, num_envs, frame_skip=FRAME_SKIP, max_ticks=None,
+                 view=(VIEW_COLS, VIEW_ROWS), enemies=NEAREST_ENEMIES):
+        load_game()
+
+        self.num_envs = num_envs
+        self.frame_skip = frame_skip
+        self.max_ticks = max_ticks
+        self.view = view
+        self.nearest = enemies
+
+        self.paths = [levels[i % len(levels)] for i in range(num_envs)]
+        self.data = {}
+
+        for path in self.paths:
+            if path not in self.data:
+                self.data[path] = LevelData(path, view)
+
+        self.groups = [(self.data[path], numpy.array([i for i in range(num_envs) if self.paths[i] == path]))
+                       for path in self.data]
+        self.levels = [self.data[path].instance() for path in self.paths]
+        self.engines = [None] * num_envs
+        self.scores = numpy.zeros(num_envs, dtype=numpy.int64)
+
+        self.controls = [game.Controls(bool(a & LEFT), bool(a & RIGHT), bool(a & JUMP), 10 if a & FAST else 5)
+                         for a in range(ACTIONS)]
+
+    def reset_one(self, i):
+        self.engines[i] = game.Engine(self.levels[i])
+        self.scores[i] = 0
+
+    def reset(self):
+        for i in range(self.num_envs):
+            self.reset_one(i)
+
+        return self.observe()
+
+    def step(self, actions):
+        actions = numpy.asarray(actions, dtype=numpy.int64)
+        rewards = numpy.zeros(self.num_envs, dtype=numpy.float32)
+        dones = numpy.zeros(self.num_envs, dtype=bool)
+        completed = numpy.zeros(self.num_envs, dtype=bool)
+        ticks = numpy.zeros(self.num_envs, dtype=numpy.int64)
+
+        for i, engine in enumerate(self.engines):
+            controls = self.controls[actions[i]]
+
+            for k in range(self.frame_skip):
+                engine.step(controls)
+
+                if engine.done():
+                    break
+
+            score = engine.hero.score
+            rewards[i] = score - self.scores[i]
+            self.scores[i] = score
+
+            if engine.done() or (self.max_ticks is not None and engine.ticks >= self.max_ticks):
+                dones[i] = True
+                completed[i] = engine.level.completed
+                ticks[i] = engine.ticks
+                self.reset_one(i)
+
+        return self.observe(), rewards, dones, {"completed": completed, "ticks": ticks}
+
+    def observe(self):
+        n = self.num_envs
+        cols = numpy.empty(n, dtype=numpy.int64)
+        rows = numpy.empty(n, dtype=numpy.int64)
+        hero = numpy.empty((n, len(HERO_FEATURES)), dtype=numpy.float32)
+        enemies = numpy.zeros((n, self.nearest, 5), dtype=numpy.float32)
+        tiles = numpy.empty((n, self.view[1], self.view[0]), dtype=numpy.uint8)
+
+        view_w = self.view[0] * game.GRID_SIZE
+        view_h = self.view[1] * game.GRID_SIZE
+
+        for i, engine in enumerate(self.engines):
+            h = engine.hero
+            rect = h.rect
+            cols[i] = rect.centerx // game.GRID_SIZE
+            rows[i] = rect.centery // game.GRID_SIZE
+            hero[i] = (rect.x, rect.y, h.vx, h.vy, h.on_ground, h.hearts, h.lives, h.score,
+                       h.coins, h.invincibility, h.jetpack_on, engine.level.time)
+
+            area = game.pygame.Rect(0, 0, view_w, view_h)
+            area.center = rect.center
+            found = [(e.rect.centerx - rect.centerx, e.rect.centery - rect.centery, e.vx, e.vy)
+                     for e in engine.level.enemy_hash.query(area)]
+
+            if len(found) > 0:
+                found.sort(key=lambda f: f[0] * f[0] + f[1] * f[1])
+                found = found[:self.nearest]
+                enemies[i, :len(found), :4] = found
+                enemies[i, :len(found), 4] = 1
+
+        for data, index in self.groups:
+            tiles[index] = data.windows(cols[index], rows[index])
+
+        return {"tiles": tiles, "hero": hero, "enemies": enemies}
+
+    def close(self):
+        pass
+
+def shard_worker(conn, paths, kwargs):
+    env = BunnyBatch(paths, len(paths), **kwargs)
+
+    while True:
+        command, data = conn.recv()
+
+        if command == "reset":
+            conn.send(env.reset())
+        elif command == "step":
+            conn.send(env.step(data))
+        else:
+            break
+
+    conn.close()
+
+class ProcessBatch():
+
+    # Splits the games over worker processes; each worker runs a BunnyBatch of its own
+    def __init__(self, levels, num_envs, workers=None, **kwargs):
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        workers = max(1, min(workers, num_envs))
+        paths = [levels[i % len(levels)] for i in range(num_envs)]
+        bounds = [num_envs * w // workers for w in range(workers + 1)]
+
+        self.num_envs = num_envs
+        self.slices = [slice(bounds[w], bounds[w + 1]) for w in range(workers)]
+        self.conns = []
+        self.processes = []
+
+        # spawn rather than fork, so no worker inherits a half-initialised SDL
+        context = multiprocessing.get_context("spawn")
+
+        for s in self.slices:
+            parent, child = context.Pipe()
+            process = context.Process(target=shard_worker, args=(child, paths[s], kwargs), daemon=True)
+            process.start()
+            child.close()
+
+            self.conns.append(parent)
+            self.processes.append(process)
+
+    def gather(self, results):
+        return {key: numpy.concatenate([r[key] for r in results]) for key in results[0]}
+
+    def reset(self):
+        for conn in self.conns:
+            conn.send(("reset", None))
+
+        return self.gather([conn.recv() for conn in self.conns])
+
+    def step(self, actions):
+        actions = numpy.asarray(actions)
+
+        for conn, s in zip(self.conns, self.slices):
+            conn.send(("step", actions[s]))
+
+        results = [conn.recv() for conn in self.conns]
+        obs = self.gather([r[0] for r in results])
+        rewards = numpy.concatenate([r[1] for r in results])
+        dones = numpy.concatenate([r[2] for r in results])
+        info = self.gather([r[3] for r in results])
+
+        return obs, rewards, dones, info
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(("close", None))
+
+        for process in self.processes:
+            process.join()
+
+def run_right(obs):
+    # Baseline policy: run right fast and jump when the cell ahead of the hero is solid
+    tiles = obs["tiles"]
+    ahead = tiles[:, VIEW_ROWS // 2, VIEW_COLS // 2 + 1] | tiles[:, VIEW_ROWS // 2 - 1, VIEW_COLS // 2 + 1]
+    enemy_ahead = (obs["enemies"][:, 0, 4] > 0) & (obs["enemies"][:, 0, 0] > 0) & (obs["enemies"][:, 0, 0] < ALERT_DISTANCE)
+
+    return RIGHT + FAST + JUMP * (ahead | enemy_ahead)
+
+def evaluate(env, policy, episodes):
+    # Plays the same number of games on every env, at least `episodes` in all; returns their
+    # scores, completion and length. Taking the first games to finish would favour short levels.
+    per_env = -(-episodes // env.num_envs)
+    obs = env.reset()
+    scores = numpy.zeros(env.num_envs)
+    results = [[] for i in range(env.num_envs)]
+
+    while any(len(r) < per_env for r in results):
+        obs, rewards, dones, info = env.step(policy(obs))
+        scores += rewards
+
+        for i in numpy.nonzero(dones)[0]:
+            if len(results[i]) < per_env:
+                results[i].append((scores[i], info["completed"][i], info["ticks"][i]))
+            scores[i] = 0
+
+    results = numpy.array([r for env_results in results for r in env_results])
+
+    return {"score": results[:, 0], "completed": results[:, 1].astype(bool), "ticks": results[:, 2].astype(numpy.int64)}
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Play Bunny Run levels with a scripted policy")
+    parser.add_argument("levels", nargs="*", default=["levels/world-1.json"])
+    parser.add_argument("--envs", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=0, help="worker processes, 0 to step in this process")
+    parser.add_argument("--episodes", type=int, default=256)
+    parser.add_argument("--frame-skip", type=int, default=FRAME_SKIP)
+    args = parser.parse_args()
+
+    if args.workers > 0:
+        env = ProcessBatch(args.levels, args.envs, args.workers, frame_skip=args.frame_skip)
+    else:
+        env = BunnyBatch(args.levels, args.envs, frame_skip=args.frame_skip)
+
+    start = time.perf_counter()
+    stats = evaluate(env, run_right, args.episodes)
+    elapsed = time.perf_counter() - start
+    env.close()
+
+    episodes = len(stats["score"])
+    print("{} episodes in {:.1f} s ({:.0f} per minute, {:.0f} ticks/s)".format(
+        episodes, elapsed, episodes * 60 / elapsed, stats["ticks"].sum() / elapsed))
+    print("completed {:.0%}, mean score {:.0f}, mean length {:.0f} ticks".format(
+        stats["completed"].mean(), stats["score"].mean(), stats["ticks"].mean()))
@@ -0,0 +1,215 @@
+# Writes large random levels in the same JSON format as levels/world-*.json.
+#
+#   python make_level.py levels/stress.json --width 10000 --height 18 --depth 9 --bears 4000 --coins 3000 --seed 7
+#
+# The bottom --depth rows are solid ground from start to flag and the three rows
+# above the ground are always clear, so the level can be finished by running right.
+# Platforms, enemies and items go above that.
+#
+# With --stream the level is written as a directory of column chunks instead, which
+# the game loads a little at a time as the hero runs (play it with --level DIR):
+#
+#   python make_level.py levels/endless --width 200000 --bears 40000 --coins 60000 --time 99999 --stream 32
+#   python make_level.py cache/world-1 --from levels/world-1.json --stream 32
+
+import argparse
+import json
+import os
+import random
+import sys
+
+THEMES = {"grass": ("GS", "assets/Background/grass.png"),
+          "candy": ("CS", "assets/Background/candy.jpg"),
+          "sand": ("S", "assets/Background/beach.jpg"),
+          "snow": ("SN", "assets/Background/snowy_forest.jpg")}
+
+POWERUP_KINDS = ['oneups', 'hearts', 'powerup', 'bolt', 'jetpack', 'bubble']
+ENTITY_KINDS = ['bears', 'monsters', 'flyman', 'coins'] + POWERUP_KINDS + ['flag']
+CLEARANCE = 3
+
+# Must match STREAM_HEADER and STREAM_CHUNK in the game
+STREAM_HEADER = "level.json"
+STREAM_CHUNK = "chunk-{:05d}.json"
+
+def generate(width=600, height=10, depth=1, platforms=0.3, bears=60, monsters=30, flyman=20,
+             coins=80, powerups=20, theme="grass", time=None, seed=None):
+    rng = random.Random(seed)
+    block, background = THEMES[theme]
+    ground = height - depth
+    top = ground - CLEARANCE - 1
+
+    if width < 8:
+        raise ValueError("width must be at least 8")
+    if top < 1:
+        raise ValueError("height {} leaves no room above {} rows of ground".format(height, depth))
+
+    blocks = [[x, y, block] for x in range(width) for y in range(ground, height)]
+    solid = set()
+    platform_tops = []
+
+    # Floating platforms, 2 to 5 blocks long, in the rows above the clear band
+    x = 4
+
+    while x < width - 4:
+        if rng.random() < platforms:
+            y = rng.randint(1, top)
+            length = min(rng.randint(2, 5), width - 4 - x)
+
+            for i in range(length):
+                blocks.append([x + i, y, block])
+                solid.add((x + i, y))
+
+                if y > 0:
+                    platform_tops.append((x + i, y - 1))
+
+            x += length + 1
+        else:
+            x += 1
+
+    start = [1, ground - 1]
+    # The portal sits on the ground so running into it finishes the level
+    flag = [width - 2, ground - 1]
+    taken = set(solid)
+    taken.update([tuple(start), tuple(flag)])
+
+    def place(count, choose, kind):
+        spots = []
+
+        for i in range(count):
+            for attempt in range(100):
+                spot = choose()
+
+                if spot not in taken and spot[0] > start[0] + 4:
+                    break
+            else:
+                raise ValueError("no room left for {} {} in a level {} wide".format(count, kind, width))
+
+            taken.add(spot)
+            spots.append(list(spot))
+
+        return spots
+
+    def on_ground():
+        return (rng.randrange(width - 3), ground - 1)
+
+    def on_platform():
+        if len(platform_tops) == 0:
+            return on_ground()
+        return rng.choice(platform_tops)
+
+    def in_air():
+        return (rng.randrange(width - 3), rng.randint(1, ground - 1))
+
+    map_data = {"name": "Stress {}x{} (seed {})".format(width, height, seed),
+                "width": width,
+                "height": height,
+                "time": time if time is not None else 30 + width // 3,
+                "background-color": [130, 182, 255],
+                "background-img": background,
+                "background-position": "top",
+                "background-repeat-x": 1,
+                "background-fill-y": 1,
+                "scenery-img": "assets/Background/transparent.png",
+                "scenery-position": "bottom",
+                "scenery-repeat-x": 1,
+                "scenery-fill-y": 1,
+                "music": "assets/sounds/theme_of_the wanderer.ogg",
+                "start": start,
+                "gravity": 1.0,
+                "terminal-velocity": 32,
+                "blocks": blocks,
+                "bears": place(bears, lambda: on_platform() if rng.random() < 0.5 else on_ground(), "bears"),
+                "monsters": place(monsters, on_platform, "monsters"),
+                "flyman": place(flyman, in_air, "flyman"),
+                "coins": place(coins, in_air, "coins")}
+
+    counts = [0] * len(POWERUP_KINDS)
+
+    for i in range(powerups):
+        counts[rng.randrange(len(POWERUP_KINDS))] += 1
+
+    for kind, count in zip(POWERUP_KINDS, counts):
+        map_data[kind] = place(count, in_air, kind)
+
+    map_data["flag"] = [flag]
+
+    return map_data
+
+def write_stream(map_data, out_dir, chunk_cols):
+    # Splits the blocks and entities by column into files chunk_cols wide; everything
+    # else goes in the header. Returns the number of chunks.
+    cols = max([map_data['width']] + [block[0] + 1 for block in map_data['blocks']])
+    rows = max([map_data['height']] + [block[1] + 1 for block in map_data['blocks']])
+    count = (cols + chunk_cols - 1) // chunk_cols
+    chunks = [{"blocks": []} for i in range(count)]
+
+    for block in map_data['blocks']:
+        if block[0] >= 0:
+            chunks[block[0] // chunk_cols]["blocks"].append(block)
+
+    for kind in ENTITY_KINDS:
+        for item in map_data.get(kind, []):
+            chunks[min(max(item[0], 0) // chunk_cols, count - 1)].setdefault(kind, []).append(item)
+
+    header = {k: v for k, v in map_data.items() if k != 'blocks' and k not in ENTITY_KINDS}
+    header["tile-columns"] = cols
+    header["tile-rows"] = rows
+    header["chunk-columns"] = chunk_cols
+    header["chunks"] = count
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    for i, chunk in enumerate(chunks):
+        with open(os.path.join(out_dir, STREAM_CHUNK.format(i)), 'w') as f:
+            json.dump(chunk, f)
+
+    # Written last, so a game watching the directory never sees a header without its chunks
+    with open(os.path.join(out_dir, STREAM_HEADER), 'w') as f:
+        json.dump(header, f)
+
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a large Bunny Run level")
+    parser.add_argument("out", help="where to write the level JSON, - for stdout, or the directory for --stream")
+    parser.add_argument("--width", type=int, default=600, help="level width in tiles")
+    parser.add_argument("--height", type=int, default=10, help="level height in tiles")
+    parser.add_argument("--depth", type=int, default=1, help="rows of solid ground at the bottom")
+    parser.add_argument("--platforms", type=float, default=0.3, help="chance of a platform starting in each column")
+    parser.add_argument("--bears", type=int, default=60)
+    parser.add_argument("--monsters", type=int, default=30)
+    parser.add_argument("--flyman", type=int, default=20)
+    parser.add_argument("--coins", type=int, default=80)
+    parser.add_argument("--powerups", type=int, default=20, help="spread over oneups, hearts, powerups, bolts, jetpacks and bubbles")
+    parser.add_argument("--theme", choices=sorted(THEMES), default="grass")
+    parser.add_argument("--time", type=int, help="seconds allowed, by default 30 plus a third of the width")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stream", type=int, metavar="COLUMNS", help="write a directory of chunks this many tiles wide")
+    parser.add_argument("--from", dest="source", metavar="FILE", help="use this level instead of generating one")
+    args = parser.parse_args()
+
+    if args.stream is not None and (args.stream < 1 or args.out == "-"):
+        parser.error("--stream needs a positive width and a directory to write to")
+
+    if args.source:
+        with open(args.source) as f:
+            map_data = json.load(f)
+    else:
+        try:
+            map_data = generate(args.width, args.height, args.depth, args.platforms, args.bears, args.monsters,
+                                args.flyman, args.coins, args.powerups, args.theme, args.time, args.seed)
+        except ValueError as e:
+            parser.error(str(e))
+
+    entities = sum(len(map_data[kind]) for kind in ENTITY_KINDS[:-1])
+    chunks = ""
+
+    if args.stream is not None:
+        chunks = " in {} chunks".format(write_stream(map_data, args.out, args.stream))
+    elif args.out == "-":
+        json.dump(map_data, sys.stdout)
+    else:
+        with open(args.out, 'w') as f:
+            json.dump(map_data, f)
+
+    print("{}: {} tiles, {} entities{}".format(map_data["name"], len(map_data["blocks"]), entities, chunks), file=sys.stderr)
@@ -0,0 +1,63 @@
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ASSET_DIRS = ["Background", "Enemies", "Environment", "Items", "Particles", "Players", "fonts"]
+
+def game_dir(tmp_path_factory):
+    # The game loads assets/... and levels/... relative to where it runs. A full install
+    # has those; a plain checkout keeps the art at the top level, so lay it out the same
+    # way in a temporary directory, dropping any picture or song the checkout doesn't have.
+    if os.path.isdir(os.path.join(ROOT, "assets")):
+        return ROOT
+
+    if not all(os.path.isdir(os.path.join(ROOT, name)) for name in ASSET_DIRS):
+        pytest.skip("needs the game's art")
+
+    work = tmp_path_factory.mktemp("game")
+    os.mkdir(work / "assets")
+    os.mkdir(work / "levels")
+
+    for name in ASSET_DIRS:
+        os.symlink(os.path.join(ROOT, name), work / "assets" / name)
+
+    for name in sorted(os.listdir(ROOT)):
+        if name.startswith("world-") and name.endswith(".json"):
+            with open(os.path.join(ROOT, name)) as f:
+                map_data = json.load(f)
+
+            for key, value in map_data.items():
+                if key.endswith("-img") or key == "music":
+                    if value != "" and not os.path.exists(work / value):
+                        map_data[key] = ""
+
+            with open(work / "levels" / name, 'w') as f:
+                json.dump(map_data, f)
+
+    return str(work)
+
+@pytest.fixture(scope="session")
+def game(tmp_path_factory):
+    import bunny_env
+
+    if bunny_env.game is None:
+        os.chdir(game_dir(tmp_path_factory))
+        spec = importlib.util.spec_from_file_location("bunny_run", bunny_env.GAME_FILE)
+        bunny_env.game = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(bunny_env.game)
+
+    return bunny_env.game
+
+@pytest.fixture
+def level_path(game, tmp_path):
+    # A private copy of world-1 that a test can rewrite
+    path = tmp_path / "world-1.json"
+    path.write_text(open(os.path.join("levels", "world-1.json")).read())
+
+    return str(path)
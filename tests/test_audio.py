@@ -0,0 +1,58 @@
+import threading
+import time
+
+def fake_mixer(game, monkeypatch, calls, release):
+    started = threading.Event()
+
+    def load(path):
+        calls.append(("load", path))
+        started.set()
+        release.wait(5)
+
+    monkeypatch.setattr(game.pygame.mixer.music, 'load', load)
+    monkeypatch.setattr(game.pygame.mixer.music, 'play', lambda loops: calls.append(("play", loops)))
+    monkeypatch.setattr(game.pygame.mixer.music, 'stop', lambda: calls.append(("stop", None)))
+    monkeypatch.setattr(game, 'sound_on', True)
+    return started
+
+def test_music_calls_dont_wait_for_the_load(game, monkeypatch):
+    audio = game.AudioManager(2)
+    calls = []
+    release = threading.Event()
+    started = fake_mixer(game, monkeypatch, calls, release)
+
+    audio.load_music("song.ogg")
+    assert started.wait(5)
+
+    # The main thread returns straight away while the worker is still loading
+    begin = time.perf_counter()
+    audio.play_music()
+    audio.stop_music()
+    elapsed = time.perf_counter() - begin
+
+    assert not release.is_set()
+    assert elapsed < 0.5
+    assert audio.lock.acquire(blocking=False)
+    audio.lock.release()
+
+    release.set()
+    audio.executor.submit(lambda: None).result()
+
+    # The stop came after the play, so the play is dropped and the stop runs after the load
+    assert calls == [("load", "song.ogg"), ("stop", None)]
+    assert audio.loaded == "song.ogg"
+
+def test_music_requested_during_the_load_starts_once_loaded(game, monkeypatch):
+    audio = game.AudioManager(2)
+    calls = []
+    release = threading.Event()
+    started = fake_mixer(game, monkeypatch, calls, release)
+
+    audio.load_music("song.ogg")
+    assert started.wait(5)
+    audio.play_music()
+
+    release.set()
+    audio.executor.submit(lambda: None).result()
+
+    assert calls == [("load", "song.ogg"), ("play", -1)]
@@ -0,0 +1,59 @@
+import json
+
+def cell_collider(game, blocks):
+    # The way collisions worked before merging: one rectangle per block, hits in file order
+    size = game.GRID_SIZE
+    rects = [game.pygame.Rect(col * size, row * size, size, size) for col, row, name in blocks]
+
+    def collide(rect):
+        return [block for block in rects if rect.colliderect(block)]
+
+    return collide
+
+def jetpack_run(game, level, x):
+    engine = game.Engine(level)
+    engine.hero.rect.x = x
+    game.Jetpack(0, 0, game.item_images["jetpack"]).apply(engine.hero)
+    path = []
+
+    for tick in range(60):
+        engine.step(game.Controls(left=tick % 7 == 0, right=tick % 7 != 0, jump=tick % 20 == 0))
+        path.append((tuple(engine.hero.rect), engine.hero.vx, engine.hero.vy))
+
+    return path
+
+def test_jetpack_inside_a_wide_platform_matches_per_cell_blocks(game, level_path):
+    with open(level_path) as f:
+        map_data = json.load(f)
+
+    # Jetpack.apply puts the hero at y = 64, inside these platforms
+    name = map_data['blocks'][0][2]
+    map_data['width'] = 40
+    map_data['blocks'] = ([[col, 1, name] for col in range(3, 13)] +
+                          [[col, row, name] for row in (0, 1) for col in range(16, 20)] +
+                          [[col, 9, name] for col in range(40)])
+
+    for kind in game.ENTITY_KINDS:
+        map_data[kind] = []
+
+    map_data['flag'] = [[39, 8]]
+    blocks = map_data['blocks']
+    orders = [blocks, blocks[::-1], sorted(blocks), sorted(blocks)[::-1]]
+    size = game.GRID_SIZE
+    checked = 0
+
+    for x in range(2 * size, 21 * size, 23):
+        level = game.Level(level_path, json.loads(json.dumps(map_data)))
+        merged = jetpack_run(game, level, x)
+        paths = []
+
+        for order in orders:
+            level.tiles.collide = cell_collider(game, order)
+            paths.append(jetpack_run(game, level, x))
+
+        # Where the old result hung on which block came first in the file, there's nothing to match
+        if all(path == paths[0] for path in paths):
+            assert merged == paths[0], x
+            checked += 1
+
+    assert checked >= 15
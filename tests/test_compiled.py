@@ -0,0 +1,51 @@
+import concurrent.futures
+import json
+import os
+
+def test_compiled_path_depends_on_the_directory(game, tmp_path):
+    first = game.compiled_path(os.path.join("levels", "world-1.json"))
+    second = game.compiled_path(str(tmp_path / "world-1.json"))
+
+    assert first != second
+    assert os.path.basename(first).startswith("world-1")
+
+def test_corrupt_compiled_level_is_rebuilt(game, level_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(game, 'LEVEL_CACHE', str(tmp_path / "cache"))
+    monkeypatch.setattr(game, 'compile_levels', True)
+    expected = game.load_map(level_path)
+    path = game.compiled_path(level_path)
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    for damaged in (data[:len(data) // 2], data[:10], data[:8] + b"{" + data[9:]):
+        with open(path, 'wb') as f:
+            f.write(damaged)
+
+        map_data = game.load_map(level_path)
+
+        assert map_data['coins'] == expected['coins']
+        assert bytes(b"".join(map_data['tiles'].columns)) == bytes(b"".join(expected['tiles'].columns))
+
+def test_concurrent_compiles_dont_share_a_temp_file(game, level_path, tmp_path):
+    out_path = str(tmp_path / "cache" / "world-1.lvl")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        for future in [executor.submit(game.compile_level, level_path, out_path) for i in range(8)]:
+            future.result()
+
+    assert os.listdir(str(tmp_path / "cache")) == ["world-1.lvl"]
+    assert game.load_compiled(out_path)['coins'] == game.load_map(level_path)['coins']
+
+def test_unreadable_recompile_falls_back_to_json(game, level_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(game, 'LEVEL_CACHE', str(tmp_path / "cache"))
+    monkeypatch.setattr(game, 'compile_levels', True)
+
+    def torn(path):
+        raise ValueError("corrupt compiled level " + path)
+
+    monkeypatch.setattr(game, 'load_compiled', torn)
+    map_data = game.load_map(level_path)
+
+    with open(level_path) as f:
+        assert map_data == json.load(f)
@@ -0,0 +1,28 @@
+import os
+import types
+
+def test_engine_replays_a_finished_level(game):
+    level = game.Level(os.path.join("levels", "world-1.json"))
+    engine = game.Engine(level)
+
+    for tick in range(30):
+        engine.step(game.Controls(False, True, False, 5))
+
+    level.time = 0
+    level.completed = True
+    engine = game.Engine(level)
+
+    assert level.time == level.time_limit
+    assert not level.completed
+    assert engine.hero.rect.x == level.start_x
+
+def test_engine_only_times_steps_for_the_profiler_its_given(game, monkeypatch):
+    level = game.Level(os.path.join("levels", "world-1.json"))
+    monkeypatch.setattr(game, 'profiler', None)
+    game.Engine(level).step(game.Controls())
+
+    laps = []
+    engine = game.Engine(level, profiler=types.SimpleNamespace(lap=laps.append))
+    engine.step(game.Controls())
+
+    assert laps == ["stream", "hero", "enemies"]
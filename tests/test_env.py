@@ -0,0 +1,53 @@
+import os
+
+import numpy
+
+import bunny_env
+
+def test_games_on_a_level_share_the_parsed_map(game):
+    data = bunny_env.LevelData(os.path.join("levels", "world-1.json"), (bunny_env.VIEW_COLS, bunny_env.VIEW_ROWS))
+    first = data.instance()
+    second = data.instance()
+
+    assert first.tiles is second.tiles is data.tiles
+    assert first.starting_enemies[0] is not second.starting_enemies[0]
+
+    first.starting_coins[0].kill()
+    assert second.starting_coins[0].alive()
+
+def test_batch_steps_and_restarts(game):
+    env = bunny_env.BunnyBatch([os.path.join("levels", "world-1.json")], 2, max_ticks=20)
+    obs = env.reset()
+    assert obs['tiles'].shape == (2, bunny_env.VIEW_ROWS, bunny_env.VIEW_COLS)
+
+    finished = False
+
+    for step in range(10):
+        obs, rewards, dones, info = env.step([bunny_env.RIGHT, bunny_env.LEFT])
+        finished = finished or bool(dones.any())
+
+    assert finished
+
+class UnevenEnv():
+
+    # Env 0 finishes a completed game every step, env 1 fails one every fifth step
+    num_envs = 2
+
+    def __init__(self):
+        self.ticks = 0
+
+    def reset(self):
+        return None
+
+    def step(self, actions):
+        self.ticks += 1
+        dones = numpy.array([True, self.ticks % 5 == 0])
+        info = {"completed": numpy.array([True, False]), "ticks": numpy.array([1, 5])}
+        return None, numpy.ones(2), dones, info
+
+def test_evaluate_plays_every_env_equally():
+    stats = bunny_env.evaluate(UnevenEnv(), lambda obs: None, 6)
+
+    assert len(stats["score"]) == 6
+    assert stats["completed"].sum() == 3
+    assert sorted(stats["ticks"]) == [1, 1, 1, 5, 5, 5]
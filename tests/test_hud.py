@@ -0,0 +1,50 @@
+import os
+
+def display_stats(game, surface, hero, level, current_level):
+    # Game.display_stats as it was before the Hud class, drawing straight to the screen
+    font = game.Bubblegum_Font
+    hearts_text = font.render("Hearts: " + str(hero.hearts)+ "/" + str(hero.max_hearts), 1, game.WHITE)
+    lives_text = font.render("x  " + str(hero.lives), 1, game.WHITE)
+    score_text = font.render("Score: " + str(hero.score), 1, game.WHITE)
+    level_text = font.render("Level: " + str(current_level + 1), 1, game.WHITE)
+    coins_text = font.render("Coins: " + str(hero.coins), 1, game.WHITE)
+    time_text = font.render("Time Remaining: " + str(level.time//60), 1, game.WHITE)
+
+    surface.blit(score_text, (game.WIDTH - score_text.get_width() - 32, 32))
+    surface.blit(hearts_text, (32, 32))
+    surface.blit(game.bunny_images["idle"], (32, 64))
+    surface.blit(lives_text, (128, 80))
+    surface.blit(level_text, (32, 128))
+    surface.blit(coins_text, (32, 160))
+    surface.blit(time_text, (32, 192))
+    if hero.jetpack_on == True:
+        jetpack_text = font.render("Jetpack Time: " + str(hero.jetpack_time//60), 1, game.WHITE)
+        surface.blit(jetpack_text, (32, 224))
+
+def background(game):
+    # Stripes in every channel, so any change in blending shows up
+    surface = game.pygame.Surface([game.WIDTH, game.HEIGHT])
+
+    for x in range(0, game.WIDTH, 8):
+        surface.fill(((x * 7) % 256, (x * 3) % 256, 255 - x % 256), [x, 0, 8, game.HEIGHT])
+
+    return surface
+
+def test_hud_matches_drawing_straight_to_the_screen(game):
+    level = game.Level(os.path.join("levels", "world-1.json"))
+    hero = game.Character(game.bunny_images, muted=True)
+    hud = game.Hud()
+
+    states = [{}, {'score': 1250, 'coins': 7}, {'jetpack_on': True, 'jetpack_time': 170},
+              {'jetpack_on': True, 'jetpack_time': 40, 'hearts': 1}, {'jetpack_on': False, 'lives': 12}]
+
+    for changes in states:
+        for name, value in changes.items():
+            setattr(hero, name, value)
+
+        expected = background(game)
+        display_stats(game, expected, hero, level, 2)
+        actual = background(game)
+        hud.draw(actual, hero, level, 2)
+
+        assert game.pygame.image.tostring(actual, "RGB") == game.pygame.image.tostring(expected, "RGB"), changes
@@ -0,0 +1,111 @@
+import json
+import os
+import types
+
+def read(path):
+    with open(path) as f:
+        return json.load(f)
+
+def empty_cell(level):
+    for col in range(level.tiles.cols):
+        if level.tiles.get(col, 1) is None:
+            return col, 1
+
+def test_patch_applies_tiles_and_settings(game, level_path):
+    level = game.Level(level_path)
+    map_data = read(level_path)
+    col, row = empty_cell(level)
+    name = map_data['blocks'][0][2]
+
+    map_data['blocks'].append([col, row, name])
+    map_data['time'] += 10
+    chunk = col * game.GRID_SIZE // game.CHUNK_WIDTH
+    level.tile_cache.get(chunk)
+
+    assert level.patch(map_data) is not None
+    assert level.tiles.get(col, row) == name
+    assert level.time_limit == map_data['time'] * game.FPS
+    assert chunk not in level.tile_cache.chunks
+
+    probe = game.pygame.Rect(col * game.GRID_SIZE, row * game.GRID_SIZE, game.GRID_SIZE, game.GRID_SIZE)
+    assert len(level.tiles.collide(probe)) > 0
+
+def test_rejected_patch_leaves_level_alone(game, level_path):
+    level = game.Level(level_path)
+    col, row = empty_cell(level)
+    chunk = col * game.GRID_SIZE // game.CHUNK_WIDTH
+    level.tile_cache.get(chunk)
+    columns = [bytes(c) for c in level.tiles.columns]
+    time_limit = level.time_limit
+    enemies = list(level.starting_enemies)
+
+    missing_time = read(level_path)
+    missing_time['blocks'].append([col, row, missing_time['blocks'][0][2]])
+    missing_time['bears'].append([col, row])
+    del missing_time['time']
+
+    bad_name = read(level_path)
+    bad_name['blocks'].append([col, row, ["x"]])
+
+    bad_position = read(level_path)
+    bad_position['blocks'].append([col, row, bad_position['blocks'][0][2]])
+    bad_position['coins'].append(["3", 4])
+
+    for map_data, error in ((missing_time, KeyError), (bad_name, ValueError), (bad_position, ValueError)):
+        try:
+            level.patch(map_data)
+        except error:
+            pass
+        else:
+            assert False, "patch should have failed"
+
+        assert [bytes(c) for c in level.tiles.columns] == columns
+        assert level.time_limit == time_limit
+        assert level.starting_enemies == enemies
+        assert chunk in level.tile_cache.chunks
+
+def test_watcher_retries_after_bad_save(game, level_path, monkeypatch):
+    monkeypatch.setattr(game, 'watch_interval', 0)
+    level = game.Level(level_path)
+    fake = types.SimpleNamespace(level=level, shown=True)
+    watcher = game.LevelWatcher()
+    watcher.check(fake)
+    col, row = empty_cell(level)
+    good = read(level_path)
+    good['blocks'].append([col, row, good['blocks'][0][2]])
+
+    def save(map_data, when):
+        with open(level_path, 'w') as f:
+            json.dump(map_data, f)
+
+        os.utime(level_path, ns=(when, when))
+
+    bad = dict(good, blocks=good['blocks'] + [[0, 0, ["x"]]])
+    save(bad, 10 ** 18)
+    watcher.check(fake)
+    assert level.tiles.get(col, row) is None
+    assert fake.shown
+
+    save(good, 2 * 10 ** 18)
+    watcher.check(fake)
+    assert level.tiles.get(col, row) == good['blocks'][0][2]
+    assert fake.shown is None
+
+def test_watcher_sees_a_save_made_before_its_first_check(game, level_path, monkeypatch):
+    # Like a level the prefetcher built while the one before it was still being played
+    monkeypatch.setattr(game, 'watch_interval', 0)
+    level = game.Level(level_path)
+    col, row = empty_cell(level)
+    edited = read(level_path)
+    edited['blocks'].append([col, row, edited['blocks'][0][2]])
+
+    with open(level_path, 'w') as f:
+        json.dump(edited, f)
+
+    os.utime(level_path, ns=(10 ** 18, 10 ** 18))
+
+    fake = types.SimpleNamespace(level=level, shown=True)
+    game.LevelWatcher().check(fake)
+
+    assert level.tiles.get(col, row) == edited['blocks'][0][2]
+    assert level.stamp == (10 ** 18, os.path.getsize(level_path))
@@ -0,0 +1,37 @@
+import types
+
+import pytest
+
+def make_scheduler(game, x):
+    if game.numpy is None:
+        pytest.skip("needs NumPy")
+
+    x = game.numpy.array(x, dtype=game.numpy.int64)
+    scheduler = game.EnemyScheduler(range(len(x)), lambda i: int(x[i]), lambda idx: x[idx])
+
+    return scheduler, x
+
+def test_settle_rebuckets_only_enemies_that_crossed(game):
+    w = game.SECTOR_WIDTH
+    scheduler, x = make_scheduler(game, [10, w - 5, w + 10, 2 * w + 3, 50 * w])
+    hero = types.SimpleNamespace(rect=game.pygame.Rect(w, 0, 10, 10))
+
+    assert sorted(scheduler.wake(hero)) == [0, 1, 2, 3]
+
+    x[1] += 10
+    x[3] -= 2 * w
+    scheduler.settle()
+
+    assert scheduler.home == {0: 0, 1: 1, 2: 1, 3: 0, 4: 50}
+    assert set(scheduler.sectors[0]) == {0, 3}
+    assert set(scheduler.sectors[1]) == {1, 2}
+    assert len(scheduler.sectors.get(2, ())) == 0
+    assert sorted(scheduler.wake(hero)) == [0, 1, 2, 3]
+
+def test_settle_with_nothing_awake(game):
+    scheduler, x = make_scheduler(game, [100 * game.SECTOR_WIDTH])
+    hero = types.SimpleNamespace(rect=game.pygame.Rect(0, 0, 10, 10))
+
+    assert scheduler.wake(hero) == []
+    scheduler.settle()
+    assert scheduler.home == {0: 100}
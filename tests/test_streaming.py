@@ -0,0 +1,66 @@
+import json
+import os
+import types
+
+import pytest
+
+import make_level
+
+@pytest.fixture
+def streamed(game, tmp_path):
+    with open(os.path.join("levels", "world-1.json")) as f:
+        map_data = json.load(f)
+
+    path = str(tmp_path / "world-1")
+    make_level.write_stream(map_data, path, 16)
+    level = game.open_level(path)
+    level.reset()
+
+    return level
+
+def chunk_state(game, level, index):
+    first, last = level.chunks[index]['columns']
+    area = game.pygame.Rect(first * game.GRID_SIZE, 0, (last - first) * game.GRID_SIZE, level.tiles.rows * game.GRID_SIZE)
+    sprites = level.chunks[index]['sprites']
+
+    return {'columns': [bytes(level.tiles.columns[col]) for col in range(first, last)],
+            'colliders': sorted(tuple(rect) for rect in level.tiles.collide(area)),
+            'enemies': sorted(tuple(s.rect) for g, s in sprites if g == 'enemies' and s in level.scheduler.home),
+            'coins': sorted(tuple(s.rect) for g, s in sprites if g == 'coins' and s in level.coin_hash)}
+
+def test_released_chunk_comes_back_the_same(game, streamed):
+    level = streamed
+    index = next(i for i, chunk in sorted(level.chunks.items())
+                 if {'enemies', 'coins'} <= set(g for g, s in chunk['sprites']))
+    before = chunk_state(game, level, index)
+    assert len(before['colliders']) > 0
+
+    # Collect one coin and let the level note it
+    coin = next(s for g, s in level.chunks[index]['sprites'] if g == 'coins')
+    level.coin_hash.collide(types.SimpleNamespace(rect=coin.rect.copy()), True)
+    hero = types.SimpleNamespace(rect=game.pygame.Rect(level.start_x, level.start_y, 10, 10))
+    level.stream(hero)
+    assert index in level.chunks
+
+    enemies = [s for g, s in level.chunks[index]['sprites'] if g == 'enemies']
+    colliders = level.chunks[index]['colliders']
+    level.release(index)
+
+    assert index not in level.chunks
+    assert not any(e in level.scheduler.home for e in enemies)
+    assert not any(n in level.tiles.colliders for n in colliders)
+
+    level.request([index])
+    level.finish(index)
+    after = chunk_state(game, level, index)
+
+    assert after['columns'] == before['columns']
+    assert after['colliders'] == before['colliders']
+    assert after['enemies'] == before['enemies']
+    assert after['coins'] == [rect for rect in before['coins'] if rect != tuple(coin.rect)]
+
+def test_engine_refuses_to_snapshot_a_streamed_level(game, streamed):
+    engine = game.Engine(streamed)
+
+    with pytest.raises(TypeError):
+        engine.snapshot()